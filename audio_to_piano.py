@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import argparse
+import json
 import logging
 import os
+import resource
+import shutil
 import sys
+import time
 import traceback
 from glob import glob
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
 
-import youtube_dl
-
-from decomposer import Decomposer
+from chromagram_cache import ChromagramCache, pin_numba_cache
+from media_ingest import MEDIA_EXTENSIONS, ingest_media
+from metrics import JobMetrics
+from note_events import NOTE_FORMATS, write_notes
+from output_catalog import OutputCatalog, song_name
 
 # logger with special stream handling to output to stdout in Node.js
 logging.basicConfig(level=logging.INFO)
@@ -19,9 +27,6 @@ stdout_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
 stdout_handler.setLevel(logging.INFO)
 logger.addHandler(stdout_handler)
 
-existing_inputs = [x.strip('.wav').strip('input/') for x in glob('input/*wav')]
-existing_ouputs = [x.strip('.mp4').strip('output/') for x in glob('output/*mp4')]
-
 
 class DecomposerError(Exception):
     def __init__(self, message=''):
@@ -37,14 +42,18 @@ def setup_dirs():
         pass
 
 
-def _download_youtube_vid(youtube_url, youtube_id):
+def _download_youtube_vid(youtube_url, youtube_id, catalog):
     """
-    Download Youtube video.
+    Download Youtube video, and extract its audio into the input dir.
     Args:
         youtube_url (str): youtube video url
+        youtube_id (str): youtube video id
+        catalog (OutputCatalog): catalog of the downloaded and rendered songs
     Returns:
-        raw_name (str): the youtube id hash only
+        song_file (str): path of the audio in the input dir
     """
+    import youtube_dl
+
     options = {
         # todo youtube-dl issue, cant download only audio, getting codec issue
         'outtmpl': '%(id)s' + '.mp4',
@@ -52,26 +61,15 @@ def _download_youtube_vid(youtube_url, youtube_id):
     }
     with youtube_dl.YoutubeDL(options) as ydl:
         try:
+            start = time.time()
             ydl.download([youtube_url])
-            logger.info(f'[PIPELINE] >>>> Sucessfully downloaded video file {youtube_id}.')
+            logger.info(
+                f'[PIPELINE] >>>> Sucessfully downloaded video file {youtube_id} in {time.time() - start:.2f}s.'
+            )
             try:
-                # use ffmpeg to conver the .mp4 file to a (compressed) .wav
-                wav_name = youtube_id + '.wav'
-                os.system(f'ffmpeg -y -i {youtube_id}.mp4 -f mp3 -ab 192000 -vn input/{youtube_id}.mp3')
-                os.system(f'ffmpeg -y -i input/{youtube_id}.mp3 -acodec pcm_u8 -ar 22050 input/{youtube_id}.wav')
-                logger.info(f'[PIPELINE] >>>> Sucessfully converted video file to wav: {wav_name}.')
-            except FileNotFoundError:
-                msg = (
-                    f'[PIPELINE] >>>> Youtube download and/or wav conversion failed for [{wav_name}]. '
-                    f'Double check that URL is valid.'
-                )
-                logger.error(msg)
-                raise DecomposerError(msg)
-
-            # clean up
-            os.remove(youtube_id + '.mp4')
-            os.remove(os.path.join('input', youtube_id + '.mp3'))
-            song_file = os.path.join('input', wav_name)
+                song_file = _ingest_song(youtube_id + '.mp4', youtube_id, catalog)
+            finally:
+                os.remove(youtube_id + '.mp4')
             return song_file
 
         except youtube_dl.utils.DownloadError:
@@ -80,8 +78,28 @@ def _download_youtube_vid(youtube_url, youtube_id):
             raise DecomposerError(msg)
 
 
-def _handle_youtube_option(youtube_url):
-    """ Logic to handle option if input media is a YouTube video."""
+def _ingest_song(media_file, song, catalog):
+    """ Extract the audio of a media file into the input dir, see media_ingest.ingest_media.
+    Args:
+        media_file (str): path of the media file
+        song (str): name of the song
+        catalog (OutputCatalog): catalog of the downloaded and rendered songs
+    Returns:
+        song_file (str): path of the audio in the input dir
+    """
+    try:
+        song_file = ingest_media(media_file, os.path.join('input', song + '.flac'))
+    except OSError as e:
+        msg = f'Audio extraction failed for [{media_file}]: {e}'
+        logger.error(f'[PIPELINE] >>>> {msg}')
+        raise DecomposerError(msg)
+    catalog.add_input(song, song_file)
+    return song_file
+
+
+def _handle_youtube_option(youtube_url, catalog, notes=None, params=None):
+    """ Logic to handle option if input media is a YouTube video. Returns the audio to decompose, None if the
+    song is already rendered with params (and no notes are to be exported, see _decompose_if_needed)."""
     if 'https://www.youtube.com/watch?v=' not in youtube_url:
         msg = f'{youtube_url} is not a valid YouTube URL'
         logger.error(f'[PIPELINE] >>>> {msg}')
@@ -89,34 +107,183 @@ def _handle_youtube_option(youtube_url):
     youtube_id = youtube_url.split('=')[-1]
 
     # Download the song if needed
-    if youtube_id not in existing_inputs:
+    input_song = catalog.input(youtube_id)
+    if input_song is None:
         logger.info(f'[PIPELINE] >>>> Song not found in input database. Downloading {youtube_id}')
-        _download_youtube_vid(youtube_url, youtube_id)
+        input_song = _download_youtube_vid(youtube_url, youtube_id, catalog)
 
-    # Decompose if not done already
-    if youtube_id not in existing_ouputs:
-        logger.info(f'[PIPELINE] >>>> Song not found in output database. Decomposing {youtube_id}')
-        return os.path.join('input', youtube_id + '.wav')
-    else:
-        logger.info(f'[PIPELINE] >>>> {youtube_id} exists in output database. Use cached.')
-        return None
+    return _decompose_if_needed(youtube_id, input_song, catalog, notes, params)
 
 
-def _handle_local_song_option(song):
-    """ Logic to handle option if input media is a predownloaded wav. """
-    song = song.strip('.wav')
-    if song not in existing_inputs:
+def _handle_local_song_option(song, catalog, notes=None, params=None):
+    """ Logic to handle option if input media is a predownloaded song (by name), or any local media file
+    (by path), whose audio is then extracted into the input dir. Returns the audio to decompose, None if there is
+    none or the song is already rendered with params (and no notes are to be exported, see _decompose_if_needed).
+    """
+    if os.path.isfile(song) and os.path.abspath(os.path.dirname(song)) != os.path.abspath('input'):
+        if catalog.input(song_name(song)) is None:
+            _ingest_song(song, song_name(song), catalog)
+    song = song_name(song)
+    input_song = catalog.input(song)
+    if input_song is None:
         logger.error(f'[PIPELINE] >>>> Song {song} does not exist in input directory. Exiting.')
         return None
     logger.info(f'[PIPELINE] >>>> Found local video file {song}.')
+    return _decompose_if_needed(song, input_song, catalog, notes, params)
 
-    # Decompose if not done already
-    if song not in existing_ouputs:
+
+def _decompose_if_needed(song, input_song, catalog, notes=None, params=None):
+    """ Decompose a song if it was not rendered already with params (see render_params), or if its notes are to
+    be exported (only the video is cached: pass video=not is_rendered(song, catalog, params) to decompose_song).
+
+    Returns:
+        str or None: path of the audio to decompose
+    """
+    if not is_rendered(song, catalog, params):
         logger.info(f'[PIPELINE] >>>> Song not found in output database. Decomposing {song}')
-        return os.path.join('input', song + '.wav')
-    else:
-        logger.info(f'[PIPELINE] >>>> {song} exists in output database. Use cached.')
-        return None
+        return input_song
+    if notes:
+        logger.info(f'[PIPELINE] >>>> {song} exists in output database. Exporting its notes only.')
+        return input_song
+    logger.info(f'[PIPELINE] >>>> {song} exists in output database. Use cached.')
+    return None
+
+
+def render_params(max_time=None, block_duration=None, amp_thresh=None, front_end='stft'):
+    """ Decomposition parameters a video is rendered and cataloged with, see decompose_song. """
+    return {'max_time': max_time, 'block_duration': block_duration, 'amp_thresh': amp_thresh, 'front_end': front_end}
+
+
+def is_rendered(song, catalog, params=None):
+    """ Whether the video of a song (by name or path) is in the catalog, rendered with the given decomposition
+    parameters (see render_params, default ones if None). A video indexed from the output dir without parameters
+    counts as rendered with the default ones. """
+    existing = catalog.output(song_name(song))
+    if existing is None:
+        return False
+    rendered_with = json.loads(existing['params']) if existing['params'] else render_params()
+    return rendered_with == (params or render_params())
+
+
+def decompose_song(
+    input_song, max_time=None, block_duration=None, outname=None, progress=None, amp_thresh=None, cache=None,
+    render_workers=None, metrics=None, catalog=None, front_end='stft', notes=None, video=True, stream=False,
+    dsp_workers=None
+):
+    """ Decompose a wav file and render its piano visualization video, and/or export its notes.
+
+    Args:
+        input_song (str): path of the wav file
+        max_time (float): end time to trim song to
+        block_duration (float or None): stream the song in blocks of this many seconds, see Decomposer
+        outname (str or None): path of the output video, see KeyBoardVisualizer.build_movie
+        progress (callable or None): called with the name of each stage as it starts
+        amp_thresh (float or None): [0, 1] threshold of normalized amplitudes, see Decomposer.amp_thresh
+        cache (ChromagramCache or None): on-disk cache of intermediate artifacts, see Decomposer
+        render_workers (int or None): number of processes rendering video frames, see KeyBoardVisualizer.iter_frames.
+            Not available in daemonic processes (batch jobs, worker service), which cannot have children.
+        metrics (JobMetrics or None): per-job metrics of every stage, exported once the job ends (even if it fails)
+        catalog (OutputCatalog or None): catalog to record the video in once it is complete. A song whose audio and
+            parameters match a video of the catalog (e.g. the same song under another name) reuses that video.
+        front_end (str): {stft, filterbank or cqt} spectrogram to decompose, see Decomposer
+        notes (list or None): {json or midi} formats to export the note events to, next to the video (e.g.
+            output/<song>.mid). See Decomposer.note_events.
+        video (bool): render the video. Exporting notes only skips the KeyBoardVisualizer altogether, which is
+            most of the job's time.
+        stream (bool): render the video as an HLS playlist of segments next to it (output/<song>/index.m3u8),
+            playable while it is being rendered, then join them into the video. progress is called with
+            'streaming' once the first segment is playable, and the time it took since the start of the job is
+            recorded as the 'first_segment' stage.
+        dsp_workers (int or None): number of threads HPSS tiles are spread over, see Decomposer.tile_workers
+    """
+    job_start = time.time()
+    # the DSP stack is only imported once there is a song to decompose, see benchmarks/startup.py
+    from decomposer import Decomposer
+
+    song = song_name(input_song)
+    progress = progress or (lambda stage: None)
+    metrics = metrics or JobMetrics(job=song)
+    outname = outname or os.path.join('output', song + '.mp4')
+    if video and catalog is not None:
+        audio_hash = ChromagramCache.hash_file(input_song)
+        params = render_params(max_time, block_duration, amp_thresh, front_end)
+        existing = catalog.output(audio_hash=audio_hash, params=params)
+        if existing is not None:
+            _link_or_copy(existing['video_path'], outname)
+            catalog.add_output(
+                song, outname, audio_hash=audio_hash, params=params, decompose_s=existing['decompose_s'],
+                render_s=existing['render_s']
+            )
+            logger.info(f'[PIPELINE] >>>> {song} has the audio of {existing["song"]}. Use cached.')
+            if not notes:
+                return
+            video = False
+    try:
+        progress('decomposing')
+        decomposer = Decomposer(
+            input_song, stop_time=max_time, block_duration=block_duration, cache=cache, metrics=metrics,
+            front_end=front_end
+        )
+        if amp_thresh is not None:
+            decomposer.amp_thresh = amp_thresh
+        if dsp_workers:
+            decomposer.tile_workers = dsp_workers
+        start = time.time()
+        decomposer.cvt_audio_to_piano()
+        decompose_s = time.time() - start
+        logger.info(f'[PIPELINE] >>>> Song sucessfully decomposed in {decompose_s:.2f}s!')
+        if notes:
+            progress('exporting')
+            # time of the last chromagram frame, none for a clip too short for a single frame
+            n_frames = decomposer.chromagram.shape[1]
+            duration = round(float(decomposer.times[n_frames - 1]), 3) if n_frames else 0.
+            write_notes(
+                decomposer.note_events(), os.path.splitext(outname)[0], notes, song=song, duration=duration
+            )
+        if not video:
+            return
+        from key_board_visualizer import KeyBoardVisualizer
+
+        progress('rendering')
+        start = time.time()
+        # render next to the output, so an interrupted render never leaves a truncated video under its name
+        partial_outname = os.path.splitext(outname)[0] + '.partial.mp4'
+        visualizer = KeyBoardVisualizer(decomposer)
+        if stream:
+            def on_segment(n_segments):
+                if n_segments == 1:
+                    first_segment_s = time.time() - job_start
+                    metrics.record_wall('first_segment', first_segment_s)
+                    logger.info(f'[PIPELINE] >>>> First segment playable after {first_segment_s:.2f}s.')
+                    progress('streaming')
+
+            playlist = visualizer.build_stream(
+                os.path.splitext(outname)[0], workers=render_workers, on_segment=on_segment
+            )
+            visualizer.remux_stream(playlist, partial_outname)
+        else:
+            visualizer.build_movie(partial_outname, workers=render_workers)
+        os.replace(partial_outname, outname)
+        render_s = time.time() - start
+        logger.info(f'[PIPELINE] >>>> Song sucessfully rendered in {render_s:.2f}s!')
+        if catalog is not None:
+            catalog.add_output(
+                song, outname, audio_hash=audio_hash, params=params, decompose_s=decompose_s, render_s=render_s
+            )
+    finally:
+        metrics.export()
+
+
+def _link_or_copy(src, dst):
+    """ Hard link a file (no extra disk space), or copy it across file systems. """
+    if os.path.abspath(src) == os.path.abspath(dst):
+        return
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
 
 def decomposer_pipeline(arg_dict):
@@ -130,14 +297,25 @@ def decomposer_pipeline(arg_dict):
     song = arg_dict.get('song', None)
     youtube_url = arg_dict.get('youtube', None)
     max_time = arg_dict.get('max_time', None)
+    block_duration = arg_dict.get('block_duration', None)
+    amp_thresh = arg_dict.get('amp_thresh', None)
+    front_end = arg_dict.get('front_end', None) or 'stft'
+    notes = arg_dict.get('notes', None)
+    video = not arg_dict.get('no_video', False)
+    stream = arg_dict.get('stream', False)
+    dsp_workers = arg_dict.get('dsp_workers', None)
+    render_workers = arg_dict.get('render_workers', None)
+    cache = _get_cache(arg_dict)
+    params = render_params(max_time, block_duration, amp_thresh, front_end)
 
     setup_dirs()
+    catalog = _get_catalog(arg_dict)
 
     # handle downloading and setup based on media input type
     if youtube_url:
-        input_song = _handle_youtube_option(youtube_url)
+        input_song = _handle_youtube_option(youtube_url, catalog, notes, params)
     elif song:
-        input_song = _handle_local_song_option(song)
+        input_song = _handle_local_song_option(song, catalog, notes, params)
     else:
         msg = '[PIPELINE] >>>> Must choose one option: --song or --youtube'
         logger.error(msg)
@@ -146,19 +324,196 @@ def decomposer_pipeline(arg_dict):
     # Decompose the song if needed
     if input_song:
         try:
-            Decomposer(input_song, stop_time=max_time, scale=2).cvt_audio_to_piano()
-            logger.info(f'[PIPELINE] >>>> Song sucessfully decomposed!')
+            decompose_song(
+                input_song, max_time=max_time, block_duration=block_duration, amp_thresh=amp_thresh, cache=cache,
+                render_workers=render_workers, metrics=get_metrics(arg_dict, input_song), catalog=catalog,
+                front_end=front_end, notes=notes, video=video and not is_rendered(input_song, catalog, params),
+                stream=stream, dsp_workers=dsp_workers
+            )
         except Exception:
             logger.error(traceback.print_exc())
 
 
+def _get_cache(arg_dict):
+    """ Chromagram cache configured by the parsed arguments, None if disabled (empty cache dir). """
+    cache_dir = arg_dict.get('cache_dir', None)
+    if not cache_dir:
+        return None
+    return ChromagramCache(cache_dir, max_size=arg_dict.get('cache_size', None) or 1024)
+
+
+def _get_catalog(arg_dict):
+    """ Catalog of the downloaded and rendered songs configured by the parsed arguments, see OutputCatalog. """
+    return OutputCatalog(arg_dict.get('catalog', None) or os.path.join('output', 'catalog.sqlite'))
+
+
+def get_metrics(arg_dict, song, per_job=False):
+    """ Metrics of a job configured by the parsed arguments (see JobMetrics), labelled with the song name.
+
+    Args:
+        arg_dict (dict): dictionary of parsed arguments
+        song (str): path or name of the song
+        per_job (bool): for jobs sharing the arguments (batch, worker service), write every job's Prometheus
+            metrics to its own file, e.g. metrics.prom -> metrics-<song>.prom. JSON lines are appended to a
+            single file.
+    Returns:
+        JobMetrics: metrics of the job
+    """
+    job = song_name(song)
+    path = arg_dict.get('metrics', None)
+    if path and per_job and path.endswith('.prom'):
+        path = f'{os.path.splitext(path)[0]}-{job}.prom'
+    return JobMetrics(
+        job=job, path=path, profile_stage=arg_dict.get('profile', None),
+        profiler=arg_dict.get('profiler', None) or 'cprofile'
+    )
+
+
+def _collect_batch(batch):
+    """ List the media files of a batch.
+
+    Args:
+        batch (str): directory of media files, or manifest file listing one media file path per line
+    Returns:
+        list: paths of the media files
+    """
+    if os.path.isdir(batch):
+        return sorted(x for x in glob(os.path.join(batch, '*')) if x.endswith(MEDIA_EXTENSIONS))
+    with open(batch) as manifest:
+        return [line.strip() for line in manifest if line.strip() and not line.startswith('#')]
+
+
+def _batch_worker(
+    conn, input_song, max_time, block_duration, outname, amp_thresh, front_end, cache, metrics, catalog, notes, video,
+    dsp_workers
+):
+    """ Process entry point of a batch job. Sends the job's status and peak memory (MB) back over conn. """
+    result = {'status': 'ok', 'error': None}
+    try:
+        decompose_song(
+            input_song, max_time=max_time, block_duration=block_duration, outname=outname, amp_thresh=amp_thresh,
+            cache=cache, metrics=metrics, catalog=catalog, front_end=front_end, notes=notes, video=video,
+            dsp_workers=dsp_workers
+        )
+    except Exception:
+        result = {'status': 'failed', 'error': traceback.format_exc()}
+    # ru_maxrss is in KB on Linux
+    result['peak_mem'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3, 2)
+    conn.send(result)
+    conn.close()
+
+
+def decomposer_batch(arg_dict):
+    """
+    Run the decomposer pipeline on a batch of wav files, on a pool of worker processes. Every song runs in its
+    own process, so a song that fails, crashes or exceeds the timeout does not affect the rest of the batch.
+    Songs which already have an output video are skipped, unless notes are exported.
+    Args:
+        arg_dict (dict): dictionary of parsed arguments
+    Returns:
+        list: summary dict (song, status, wall time, peak memory, error) per song
+    """
+    songs = _collect_batch(arg_dict['batch'])
+    workers = arg_dict.get('workers', None) or os.cpu_count()
+    timeout = arg_dict.get('timeout', None)
+    max_time = arg_dict.get('max_time', None)
+    block_duration = arg_dict.get('block_duration', None)
+    amp_thresh = arg_dict.get('amp_thresh', None)
+    front_end = arg_dict.get('front_end', None) or 'stft'
+    notes = arg_dict.get('notes', None)
+    video = not arg_dict.get('no_video', False)
+    dsp_workers = arg_dict.get('dsp_workers', None)
+    cache = _get_cache(arg_dict)
+    params = render_params(max_time, block_duration, amp_thresh, front_end)
+
+    setup_dirs()
+    catalog = _get_catalog(arg_dict)
+    logger.info(f'[PIPELINE] >>>> Starting batch of {len(songs)} songs on {workers} workers.')
+
+    summary = []
+    pending = list(songs)
+    running = {}  # parent end of pipe -> (process, song, start time)
+    while pending or running:
+        # start new jobs while there are free workers
+        while pending and len(running) < workers:
+            song = pending.pop(0)
+            outname = os.path.join('output', song_name(song) + '.mp4')
+            if not notes and is_rendered(song, catalog, params):
+                summary.append({'song': song, 'status': 'cached', 'wall_time': 0, 'peak_mem': None, 'error': None})
+                continue
+            parent_conn, child_conn = Pipe(duplex=False)
+            process = Process(
+                target=_batch_worker,
+                args=(
+                    child_conn, song, max_time, block_duration, outname, amp_thresh, front_end, cache,
+                    get_metrics(arg_dict, song, per_job=True), catalog, notes,
+                    video and not is_rendered(song, catalog, params), dsp_workers
+                ),
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            running[parent_conn] = (process, song, time.time())
+
+        # wait for a job to report back, or exit without reporting (crash)
+        if running:
+            wait(list(running) + [process.sentinel for process, _, _ in running.values()], timeout=1)
+        for conn, (process, song, start) in list(running.items()):
+            wall_time = round(time.time() - start, 2)
+            if conn.poll():
+                try:
+                    result = conn.recv()
+                except EOFError:  # process exited without reporting
+                    process.join()
+                    result = {'status': 'crashed', 'peak_mem': None, 'error': f'exit code {process.exitcode}'}
+            elif timeout and wall_time > timeout:
+                process.terminate()
+                result = {'status': 'timeout', 'peak_mem': None, 'error': f'exceeded {timeout}s'}
+            else:
+                continue
+            process.join()
+            conn.close()
+            del running[conn]
+            summary.append(dict(song=song, wall_time=wall_time, **result))
+            logger.info(f'[PIPELINE] >>>> Batch job {song}: {result["status"]} in {wall_time}s.')
+
+    logger.info('[PIPELINE] >>>> Batch summary:')
+    for job in summary:
+        peak_mem = f'{job["peak_mem"]}MB' if job['peak_mem'] else '-'
+        logger.info(f'[PIPELINE] >>>> {job["status"]:>8} {job["wall_time"]:>9}s {peak_mem:>11}  {job["song"]}')
+        if job['error']:
+            logger.error(job['error'])
+    return summary
+
+
 if __name__ == '__main__':
+    pin_numba_cache()
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--song', default=None, type=str)
     parser.add_argument('-y', '--youtube', default=None, type=str)
     parser.add_argument('-m', '--max_time', default=None, type=int)
     parser.add_argument('-p', '--plot', default=False, type=bool)
+    parser.add_argument('-b', '--block_duration', default=None, type=float)
+    parser.add_argument('--batch', default=None, type=str)
+    parser.add_argument('-w', '--workers', default=None, type=int)
+    parser.add_argument('-t', '--timeout', default=None, type=float)
+    parser.add_argument('-a', '--amp_thresh', default=None, type=float)
+    parser.add_argument('-f', '--front_end', default='stft', choices=['stft', 'filterbank', 'cqt'])
+    parser.add_argument('-n', '--notes', default=None, nargs='+', choices=sorted(NOTE_FORMATS))
+    parser.add_argument('--no_video', action='store_true')
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('-c', '--cache_dir', default='cache', type=str)
+    parser.add_argument('--cache_size', default=1024, type=float)
+    parser.add_argument('--catalog', default=os.path.join('output', 'catalog.sqlite'), type=str)
+    parser.add_argument('--render_workers', default=None, type=int)
+    parser.add_argument('--dsp_workers', default=None, type=int)
+    parser.add_argument('--metrics', default=None, type=str)
+    parser.add_argument('--profile', default=None, type=str)
+    parser.add_argument('--profiler', default='cprofile', choices=['cprofile', 'pyinstrument'])
 
     argument_dictionary = vars(parser.parse_args())
 
-    decomposer_pipeline(argument_dictionary)
+    if argument_dictionary['batch']:
+        decomposer_batch(argument_dictionary)
+    else:
+        decomposer_pipeline(argument_dictionary)
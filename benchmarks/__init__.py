@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks, run as `python -m benchmarks.<name>`: the package is imported first, so the numba cache is pinned
+before any benchmark imports librosa."""
+from chromagram_cache import pin_numba_cache
+
+pin_numba_cache()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Deterministic synthetic songs for the benchmarks: chords of known piano keys, plus noise and percussive clicks.
+
+Run from the repo root: `python -m benchmarks.fixtures out.wav [--seconds 30]` writes a fixture and prints its chords.
+"""
+import argparse
+import json
+
+import numpy as np
+
+from signal_process_utils import key_geometry
+
+
+def key_frequencies():
+    """ Frequency (Hz) of every piano key, by key number (1 to 88), from assets/freqs.csv. """
+    geometry = key_geometry()
+    return dict(zip(geometry['key_numbers'].tolist(), geometry['frequencies'].tolist()))
+
+
+def synthetic_song(
+    seconds, sr=22050, chord_duration=1.0, notes_per_chord=3, key_range=(40, 84), noise=0.01, clicks_per_second=2,
+    seed=0
+):
+    """ Song of consecutive chords of random piano keys (pure tones with a short fade in/out), over white noise
+    and percussive clicks (short decaying noise bursts, which HPSS should remove).
+
+    Args:
+        seconds (float): length of the song
+        sr (int): sample rate
+        chord_duration (float): length of every chord in seconds
+        notes_per_chord (int): number of keys played at once
+        key_range (tuple): lowest and highest key number to draw keys from. Low keys are closer together than
+            the STFT's frequency resolution (~4Hz), the default range starts at middle C.
+        noise (float): amplitude of the white noise
+        clicks_per_second (float): rate of the percussive clicks
+        seed (int): random seed
+    Returns:
+        np.ndarray: audio time series (float32)
+        list: chords as dicts of start & stop time (s) and key numbers
+    """
+    rng = np.random.RandomState(seed)
+    freqs = key_frequencies()
+    audio = noise * rng.randn(int(seconds * sr))
+
+    chords = []
+    n_chord = int(chord_duration * sr)
+    fade = np.minimum(np.minimum(np.arange(n_chord), np.arange(n_chord)[::-1]) / (0.02 * sr), 1)
+    for start in range(0, audio.size - n_chord + 1, n_chord):
+        keys = sorted(rng.choice(np.arange(key_range[0], key_range[1] + 1), notes_per_chord, replace=False).tolist())
+        ts = np.arange(start, start + n_chord) / sr
+        for key in keys:
+            audio[start: start + n_chord] += fade * np.sin(2 * np.pi * freqs[key] * ts) / notes_per_chord
+        chords.append({'start': start / sr, 'stop': (start + n_chord) / sr, 'keys': keys})
+
+    n_click = int(0.01 * sr)
+    for start in rng.randint(0, audio.size - n_click, int(seconds * clicks_per_second)):
+        audio[start: start + n_click] += 0.5 * rng.randn(n_click) * np.exp(-np.arange(n_click) / (0.002 * sr))
+    return (audio / np.abs(audio).max()).astype(np.float32), chords
+
+
+def write_fixture(path, seconds, sr=22050, **kwargs):
+    """ Write a synthetic song (see synthetic_song) to a 16 bit wav file.
+
+    Returns:
+        list: chords of the song
+    """
+    import soundfile as sf
+
+    audio, chords = synthetic_song(seconds, sr=sr, **kwargs)
+    sf.write(path, audio, sr, subtype='PCM_16')
+    return chords
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str)
+    parser.add_argument('-s', '--seconds', default=30, type=float)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    print(json.dumps(write_fixture(args.path, args.seconds, seed=args.seed)))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compare the spectral front ends of the Decomposer (linear STFT, STFT summed by a piano key filterbank, constant-Q
+transform) for speed and note accuracy, on synthetic songs (see benchmarks.fixtures) over several key ranges: the
+bass, where keys are closer together than STFT bins, the middle of the keyboard, and the whole keyboard.
+
+Every front end runs the whole decomposition (load to normalized chromagram). Wall times are the best of --repeat
+runs, per stage and in total; recall & precision are those of benchmarks.pipeline.check_notes.
+
+Run from the repo root: `python -m benchmarks.front_end [--seconds 30] [--output front_end.json]`
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.fixtures import write_fixture
+from benchmarks.peak_picking import _best_of
+from benchmarks.pipeline import check_notes
+from decomposer import Decomposer
+
+# (lowest, highest) key numbers the chords of each fixture are drawn from
+KEY_RANGES = {'bass': (4, 40), 'middle': (40, 84), 'full': (1, 87)}
+
+
+def compare(wav_file, chords, repeat=3):
+    """ Decompose a song with every front end.
+
+    Returns:
+        dict: per front end, total & per stage wall times (s), spectrogram shape and note check
+    """
+    results = {}
+    for front_end in Decomposer.front_ends:
+        def decompose():
+            decomposer = Decomposer(wav_file, front_end=front_end)
+            decomposer.cvt_audio_to_piano()
+            return decomposer
+
+        wall_time, decomposer = _best_of(decompose, repeat)
+        stages = decomposer.metrics.stages
+        results[front_end] = {
+            'wall_s': round(wall_time, 4),
+            'stages': {name: round(stage.wall_s, 4) for name, stage in stages.items()},
+            'spectrogram': stages[front_end].arrays['spec_raw']['shape'],
+            'notes': check_notes(decomposer, chords),
+        }
+    return results
+
+
+def run_suite(seconds, repeat=3, seed=0):
+    """ Compare the front ends on a fixture per key range.
+
+    Returns:
+        dict: report
+    """
+    fixtures = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, key_range in KEY_RANGES.items():
+            wav_file = os.path.join(tmp_dir, f'{name}.wav')
+            chords = write_fixture(wav_file, seconds, seed=seed, key_range=key_range)
+            fixtures[name] = dict(key_range=list(key_range), **compare(wav_file, chords, repeat=repeat))
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seconds': seconds,
+        'seed': seed,
+        'repeat': repeat,
+        'fixtures': fixtures,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seconds', default=30, type=float)
+    parser.add_argument('-r', '--repeat', default=3, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('-o', '--output', default=None, type=str)
+    args = parser.parse_args()
+
+    report = run_suite(args.seconds, repeat=args.repeat, seed=args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
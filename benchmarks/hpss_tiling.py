@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the scaling of tiled HPSS (Decomposer._hpss, see signal_process_utils.tiled_apply) from 1 to N
+workers, on the raw spectrogram of a synthetic song (see benchmarks.fixtures).
+
+Reports the wall time (best of --repeat runs) of HPSS over the whole spectrogram at once, then tiled with every
+number of workers and executor, with the speedup over the untiled run and whether the tiled output is identical to
+it. Scaling is bounded by the cores the process may run on (reported as cores).
+
+Run from the repo root: `python -m benchmarks.hpss_tiling [--seconds 120] [--workers 1 2 4 8] [--tile_frames 1024]`
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import write_fixture
+from benchmarks.peak_picking import _best_of
+from decomposer import Decomposer
+
+
+def run_suite(seconds, workers, tile_frames=1024, executors=('thread', 'process'), repeat=3, seed=0):
+    """ Time HPSS untiled, then tiled on every number of workers with every executor.
+
+    Returns:
+        dict: report
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wav_file = os.path.join(tmp_dir, 'fixture.wav')
+        write_fixture(wav_file, seconds, seed=seed)
+        decomposer = Decomposer(wav_file)
+        spec_raw = decomposer.spec_raw
+
+    decomposer.tile_frames = spec_raw.shape[1]
+    untiled_s, expected = _best_of(lambda: decomposer._hpss(spec_raw), repeat)
+
+    runs = []
+    decomposer.tile_frames = tile_frames
+    for executor in executors:
+        decomposer.tile_executor = executor
+        for n_workers in workers:
+            decomposer.tile_workers = n_workers
+            wall_s, actual = _best_of(lambda: decomposer._hpss(spec_raw), repeat)
+            runs.append({
+                'executor': executor,
+                'workers': n_workers,
+                'wall_s': round(wall_s, 4),
+                'speedup': round(untiled_s / wall_s, 2),
+                'identical': all(np.array_equal(a, b) for a, b in zip(actual, expected)),
+            })
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seconds': seconds,
+        'spectrogram': list(spec_raw.shape),
+        'tile_frames': tile_frames,
+        'cores': len(os.sched_getaffinity(0)),
+        'repeat': repeat,
+        'untiled_s': round(untiled_s, 4),
+        'runs': runs,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seconds', default=120, type=float)
+    parser.add_argument('-w', '--workers', default=None, type=int, nargs='+', help='default: 1 to #cores')
+    parser.add_argument('-t', '--tile_frames', default=1024, type=int)
+    parser.add_argument('-e', '--executors', default=['thread', 'process'], nargs='+', choices=['thread', 'process'])
+    parser.add_argument('-r', '--repeat', default=3, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('-o', '--output', default=None, type=str)
+    args = parser.parse_args()
+
+    report = run_suite(
+        args.seconds, args.workers or list(range(1, len(os.sched_getaffinity(0)) + 1)),
+        tile_frames=args.tile_frames, executors=args.executors, repeat=args.repeat, seed=args.seed
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
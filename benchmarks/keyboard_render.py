@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Validate & benchmark the key-sprite compositor (KeyBoardVisualizer._generate_keyboard) against the
+original implementation, which drew & pasted a full-frame PIL polygon for every active note of every frame.
+Then benchmark rendering the video frames (resampled to the output fps and deduplicated) against rendering
+every video frame from scratch.
+
+Run from the repo root: `python -m benchmarks.keyboard_render [--frames 300] [--hold 8]`
+"""
+import argparse
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from benchmarks.peak_picking import _best_of
+from decomposer import Decomposer
+from key_board_visualizer import KeyBoardVisualizer
+from metrics import JobMetrics
+from signal_process_utils import generate_frequency_table
+
+
+def synthetic_decomposer(n_frames, notes_per_frame=8, hold=1, seed=0, sr=8372, hop=512):
+    """ Stand-in for a decomposed song: a sparse raw chromagram, its normalized & thresholded chromagram, plus the
+    attributes the visualizer reads. Notes change every hold time points (sustained notes). """
+    rng = np.random.RandomState(seed)
+    chromagram_raw = np.zeros((89, n_frames))
+    for t in range(0, n_frames, hold):
+        keys = rng.choice(np.arange(1, 89), size=notes_per_frame, replace=False)
+        chromagram_raw[keys, t: t + hold] = rng.exponential(size=(notes_per_frame, 1))
+    chromagram = Decomposer._normalize_filter(chromagram_raw)
+    chromagram[chromagram < 0.3] = 0
+    return SimpleNamespace(
+        chromagram_raw=chromagram_raw,
+        chromagram=chromagram,
+        times=np.arange(n_frames) * hop / sr,
+        freq_table=generate_frequency_table(),
+        last_key_num=89,
+        amp_thresh=0.3,
+        norm_algo='div_max',
+        _normalize_filter=Decomposer._normalize_filter,
+        metrics=JobMetrics(),
+    )
+
+
+def pil_keyboard(visualizer, t):
+    """ Reference implementation: the original PIL polygon drawing and pasting. """
+    decomposer = visualizer.decomposer
+    piano_out = visualizer.piano_template.copy()
+
+    key_number_array = np.nonzero(decomposer.chromagram_raw[:, t])[0]
+    amp_array_non_zero = decomposer.chromagram_raw[key_number_array, t]
+    if key_number_array.size > 0:
+        amp_array_non_zero = decomposer._normalize_filter(amp_array_non_zero, algo=decomposer.norm_algo)
+        for n in range(key_number_array.shape[0]):
+            idx = 89 - key_number_array[n]
+            loudness = amp_array_non_zero[n]
+            if loudness > decomposer.amp_thresh:
+                piano_loc_points = decomposer.freq_table.iat[decomposer.last_key_num - 1 - idx, -1]
+                if type(piano_loc_points) is not list:
+                    continue
+                poly = Image.new('RGBA', (visualizer.length_full, visualizer.keyboard_width))
+                pdraw = ImageDraw.Draw(poly)
+                pdraw.polygon(piano_loc_points, fill=(0, 255, 0, int(255 * loudness)), outline=(0, 255, 240, 255))
+                piano_out.paste(poly, mask=poly)
+    return np.array(piano_out.convert('RGB'))
+
+
+def compare(n_frames, hold=1, repeat=3):
+    """ Render n_frames time points with both implementations and check the frames are pixel identical (with
+    unquantized loudness). Then time rendering the video frames, with and without deduplication.
+
+    Returns:
+        dict: timings
+    """
+    visualizer = KeyBoardVisualizer(synthetic_decomposer(n_frames, hold=hold))
+    visualizer.loudness_levels = 256
+    t_pil, expected = _best_of(lambda: [pil_keyboard(visualizer, t) for t in range(n_frames)], repeat)
+    t_sprites, actual = _best_of(lambda: [visualizer._generate_keyboard(t)[0] for t in range(n_frames)], repeat)
+
+    for t in range(n_frames):
+        np.testing.assert_array_equal(actual[t], expected[t], err_msg=f'frame {t}')
+
+    def render_video(dedup):
+        visualizer._frame_cache.clear()
+        visualizer.frame_cache_size = 64 if dedup else 0
+        return [frame.copy() for frame in visualizer.iter_frames()]
+
+    visualizer.loudness_levels = 64
+    n_video = visualizer.frame_time_points.shape[0]
+    t_video, _ = _best_of(lambda: render_video(dedup=False), repeat)
+    t_dedup, _ = _best_of(lambda: render_video(dedup=True), repeat)
+    return {
+        'time_points': n_frames,
+        'pil_fps': round(n_frames / t_pil, 1),
+        'sprites_fps': round(n_frames / t_sprites, 1),
+        'speedup': round(t_pil / t_sprites, 1),
+        'video_frames': n_video,
+        'video_fps': round(n_video / t_video, 1),
+        'video_dedup_fps': round(n_video / t_dedup, 1),
+        'dedup_speedup': round(t_video / t_dedup, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--frames', default=300, type=int)
+    parser.add_argument('--hold', default=1, type=int)
+    parser.add_argument('-r', '--repeat', default=3, type=int)
+    args = parser.parse_args()
+
+    print(compare(args.frames, hold=args.hold, repeat=args.repeat))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the live mode (live_decomposer.py) end to end: a synthetic song (see benchmarks.fixtures) is piped as
+raw PCM into a live_decomposer.py process at real-time speed, one hop of samples at a time, and the active keys it
+writes back are timestamped as they arrive.
+
+Reports the latency percentiles of every frame, from writing its last samples into the pipe to reading its keys
+back, the decomposer's own per-frame latency percentiles, and the note accuracy of the live keys (see
+benchmarks.pipeline.check_notes).
+
+Run from the repo root: `python -m benchmarks.live [--seconds 30] [--speed 1]`
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from benchmarks.fixtures import synthetic_song
+from benchmarks.pipeline import check_notes
+
+
+def _percentiles(seconds):
+    """ Latency percentiles (ms). """
+    latencies = np.array(seconds) * 1e3
+    report = {f'p{q}_ms': round(float(np.percentile(latencies, q)), 3) for q in (50, 90, 99)}
+    report['max_ms'] = round(float(latencies.max()), 3)
+    return report
+
+
+def run_suite(seconds=30, speed=1., sample_rate=8372, n_fft=2048, margin=0.3, seed=0, front_end='stft'):
+    """ Pipe a synthetic song through live_decomposer.py.
+
+    Args:
+        seconds (float): length of the song
+        speed (float): feeding speed, relative to real time. 0 feeds as fast as the pipe takes it.
+        sample_rate (int): sample rate of the song, and of the live decomposer
+        n_fft (int): FFT window size of the live decomposer (its hop is n_fft // 4)
+        margin (float): seconds around chord changes left out of the note check
+        seed (int): random seed of the song
+        front_end (str): {stft or filterbank}
+    Returns:
+        dict: report
+    """
+    audio, chords = synthetic_song(seconds, sr=sample_rate, seed=seed)
+    pcm = (np.clip(audio, -1, 1 - 1 / 32768) * 32768).astype('<i2').tobytes()
+    hop = n_fft // 4
+
+    process = subprocess.Popen(
+        [sys.executable, 'live_decomposer.py', '--sample_rate', str(sample_rate), '--front_end', front_end],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    # start feeding once the decomposer listens, so its startup is not counted as latency
+    log = []
+    for line in process.stderr:
+        log.append(line.decode())
+        if '[LIVE] >>>> Listening' in log[-1]:
+            break
+    threading.Thread(target=lambda: log.extend(line.decode() for line in process.stderr), daemon=True).start()
+
+    written = []  # time the last sample of every frame was written
+
+    def feed():
+        start = time.perf_counter()
+        for frame, offset in enumerate(range(0, len(audio) - hop + 1, hop)):
+            if speed:
+                time.sleep(max(start + (frame + 1) * hop / sample_rate / speed - time.perf_counter(), 0))
+            process.stdin.write(pcm[2 * offset: 2 * (offset + hop)])
+            process.stdin.flush()
+            written.append(time.perf_counter())
+        process.stdin.close()
+
+    feeder = threading.Thread(target=feed)
+    feeder.start()
+    frames = []
+    for line in process.stdout:
+        frames.append(dict(json.loads(line), received=time.perf_counter()))
+    feeder.join()
+    process.wait()
+
+    decomposer_report = json.loads(next(line for line in log if 'Latency:' in line).split('Latency: ')[1])
+    end_to_end = [frame['received'] - written[frame['frame']] for frame in frames]
+
+    # keys by frame, timed at the center of the frame's window
+    chromagram = np.zeros((89, len(frames)))
+    for frame in frames:
+        chromagram[frame['keys'], frame['frame']] = 1
+    times = np.array([frame['time'] for frame in frames]) - n_fft / 2 / sample_rate
+    notes = check_notes(SimpleNamespace(chromagram=chromagram, times=times), chords, margin=margin)
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seconds': seconds,
+        'speed': speed,
+        'front_end': front_end,
+        'frames': len(frames),
+        'end_to_end': _percentiles(end_to_end),
+        'decomposer': decomposer_report,
+        'notes': dict(notes, margin=margin),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seconds', default=30, type=float)
+    parser.add_argument('--speed', default=1., type=float)
+    parser.add_argument('--margin', default=0.3, type=float)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('-f', '--front_end', default='stft', choices=['stft', 'filterbank'])
+    parser.add_argument('-o', '--output', default=None, type=str)
+    args = parser.parse_args()
+
+    report = run_suite(
+        seconds=args.seconds, speed=args.speed, margin=args.margin, seed=args.seed, front_end=args.front_end
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
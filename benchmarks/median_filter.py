@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Validate & benchmark the 2D median filter (Decomposer._median_filter) against the row by row
+np.apply_along_axis implementation it replaces.
+
+Run from the repo root: `python -m benchmarks.median_filter [--seconds 60]`
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.peak_picking import _best_of, synthetic_spectrogram
+from decomposer import Decomposer
+
+
+def row_median_filter(arr, length=5, stride=1):
+    """ Reference implementation: the original 1D median filter, applied with np.apply_along_axis. """
+    nrows = ((arr.size - length) // stride) + 1
+    n = arr.strides[0]
+    windowed_matrix = np.lib.stride_tricks.as_strided(arr, shape=(nrows, length), strides=(stride * n, n))
+    median = np.median(windowed_matrix, axis=1)
+    arr[-median.shape[0] :] = median
+    return arr
+
+
+def compare(spec, repeat=3):
+    """ Time both implementations and check they produce the same output.
+
+    Returns:
+        dict: timings
+    """
+    t_rows, expected = _best_of(lambda: np.apply_along_axis(row_median_filter, 1, spec.copy()), repeat)
+    t_matrix, actual = _best_of(lambda: Decomposer._median_filter(spec.copy()), repeat)
+
+    assert actual.dtype == spec.dtype, 'median filter must preserve dtype'
+    np.testing.assert_allclose(actual, expected, rtol=1e-6)
+    return {
+        'shape': spec.shape,
+        'apply_along_axis_s': round(t_rows, 4),
+        'median_filter_2d_s': round(t_matrix, 4),
+        'speedup': round(t_rows / t_matrix, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seconds', default=60, type=float)
+    parser.add_argument('-r', '--repeat', default=3, type=int)
+    args = parser.parse_args()
+
+    print(compare(synthetic_spectrogram(args.seconds), repeat=args.repeat))
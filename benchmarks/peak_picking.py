@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Validate & benchmark the vectorized peak detection (signal_process_utils.find_peaks_2d) against the
+per-frame scipy.signal.find_peaks loop it replaces in Decomposer._parse_spectrogram.
+
+Run from the repo root: `python -m benchmarks.peak_picking [--seconds 60]`
+"""
+import argparse
+import time
+
+import librosa
+import numpy as np
+from scipy.signal import find_peaks
+
+from signal_process_utils import find_peaks_2d
+
+
+def per_frame_peaks(log_spec, prominence=3):
+    """ Reference implementation: the original per-frame loop of Decomposer._parse_spectrogram. """
+    mask = np.ones(log_spec.shape, dtype=bool)
+    for t in range(log_spec.shape[1]):
+        peaks_idx = find_peaks(log_spec[:, t], prominence=prominence)[0]
+        arr = mask[:, t]
+        not_indices = np.setxor1d(np.indices(arr.shape), peaks_idx)
+        arr[not_indices] = False
+        mask[:, t] = arr
+    return mask
+
+
+def synthetic_spectrogram(seconds, sr=8372, n_fft=2048, seed=0):
+    """ Magnitude spectrogram of a few sustained tones buried in noise. """
+    rng = np.random.RandomState(seed)
+    ts = np.arange(int(seconds * sr)) / sr
+    audio = 0.1 * rng.randn(ts.size)
+    for freq in (110.0, 261.63, 329.63, 392.0, 880.0):
+        audio += np.sin(2 * np.pi * freq * ts)
+    return np.abs(librosa.stft(audio.astype(np.float32), n_fft=n_fft))
+
+
+def _best_of(func, repeat):
+    """ Best wall time of `repeat` calls of func, and its (last) result. """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def compare(log_spec, prominence=3, tolerance=1e-3, repeat=3):
+    """ Time both implementations and check the fraction of mismatching peaks is within tolerance.
+
+    Returns:
+        dict: timings and mismatch stats
+    """
+    t_loop, expected = _best_of(lambda: per_frame_peaks(log_spec, prominence), repeat)
+    t_vec, actual = _best_of(lambda: find_peaks_2d(log_spec, prominence), repeat)
+
+    mismatch = np.count_nonzero(expected != actual) / max(np.count_nonzero(expected), 1)
+    assert mismatch <= tolerance, f'vectorized peaks differ from find_peaks on {mismatch:.2%} of peaks'
+    return {
+        'frames': log_spec.shape[1],
+        'per_frame_s': round(t_loop, 4),
+        'vectorized_s': round(t_vec, 4),
+        'speedup': round(t_loop / t_vec, 1),
+        'peaks': int(np.count_nonzero(expected)),
+        'mismatch': float(mismatch),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seconds', default=60, type=float)
+    parser.add_argument('-t', '--tolerance', default=1e-3, type=float)
+    parser.add_argument('-r', '--repeat', default=3, type=int)
+    args = parser.parse_args()
+
+    spec = synthetic_spectrogram(args.seconds)
+    with np.errstate(divide='ignore'):
+        print(compare(np.log(spec), tolerance=args.tolerance, repeat=args.repeat))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark every stage of the pipeline on a synthetic song (see benchmarks.fixtures), and check the chords it
+plays come out in the chromagram. Emits JSON, to track regressions across versions.
+
+Stages run one after the other on the previous stage's output: load, STFT, median filter, HPSS, vocal separation,
+peak picking, key mapping, normalization, frame rendering and encoding (skipped without moviepy). Wall time is the
+best of --repeat runs. Peak memory is measured with tracemalloc (which tracks numpy arrays) on a separate run.
+
+Run from the repo root: `python -m benchmarks.pipeline [--seconds 30] [--output bench.json]`
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import librosa
+import numpy as np
+
+from benchmarks.fixtures import write_fixture
+from benchmarks.peak_picking import _best_of
+from decomposer import Decomposer
+from key_board_visualizer import KeyBoardVisualizer
+
+
+def _measure(func, repeat):
+    """ Time func (best of repeat runs), and measure its peak memory allocation on one more run.
+
+    Returns:
+        object: result of func
+        dict: wall time (s) and peak allocated memory (MB)
+    """
+    wall_time, result = _best_of(func, repeat)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {'wall_s': round(wall_time, 4), 'peak_mb': round(peak / 1e6, 2)}
+
+
+def _describe(result):
+    """ Shapes & dtypes of the arrays a stage returned. """
+    arrays = result if isinstance(result, tuple) else (result,)
+    return [{'shape': list(x.shape), 'dtype': str(x.dtype)} for x in arrays if isinstance(x, np.ndarray)]
+
+
+def check_notes(decomposer, chords, margin=0.3):
+    """ Compare the thresholded chromagram with the chords the song plays. Time points within margin seconds of a
+    chord change are ignored: the median filters delay the chromagram by a few time points, and HPSS smears it.
+
+    Returns:
+        dict: recall (fraction of played key/time points detected) & precision (fraction of detected key/time
+            points played)
+    """
+    chromagram = decomposer.chromagram
+    times = decomposer.times[:chromagram.shape[1]]
+
+    # chromagram rows are key numbers
+    expected = np.zeros(chromagram.shape, dtype=bool)
+    scored = np.zeros(chromagram.shape[1], dtype=bool)
+    for chord in chords:
+        in_chord = (times >= chord['start'] + margin) & (times < chord['stop'] - margin)
+        expected[np.ix_(chord['keys'], np.nonzero(in_chord)[0])] = True
+        scored |= in_chord
+
+    detected = chromagram[:, scored] > 0
+    expected = expected[:, scored]
+    return {
+        'recall': round(float(np.count_nonzero(detected & expected) / max(np.count_nonzero(expected), 1)), 4),
+        'precision': round(float(np.count_nonzero(detected & expected) / max(np.count_nonzero(detected), 1)), 4),
+        'time_points': int(np.count_nonzero(scored)),
+    }
+
+
+def run_suite(seconds, repeat=3, seed=0, encode=True):
+    """ Benchmark every stage on a synthetic song of a given length.
+
+    Returns:
+        dict: report (environment, stage timings & memory, note check)
+    """
+    stages = {}
+
+    def stage(name, func):
+        result, stats = _measure(func, repeat)
+        stages[name] = dict(stats, output=_describe(result))
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wav_file = os.path.join(tmp_dir, 'fixture.wav')
+        chords = write_fixture(wav_file, seconds, seed=seed)
+
+        decomposer = stage('load', lambda: Decomposer(wav_file))
+        stages['load']['output'] = _describe(decomposer.audio_ts)
+
+        stft = stage('stft', lambda: librosa.magphase(librosa.stft(decomposer.audio_ts, n_fft=decomposer.n_fft))[0])
+        spec_raw = stage('median_filter', lambda: decomposer._median_filter(stft.copy()))
+        spec_harmonic = stage('hpss', lambda: decomposer._resolve_spectrogram('harmonic', {'raw': spec_raw}))
+        stage('vocal_separation', lambda: decomposer._spectrogram_separate_vocals(spec_harmonic))
+        dominant_amplitudes = stage('peak_picking', lambda: decomposer._find_dominant_amplitudes(spec_harmonic))
+        chromagram_raw = stage('key_mapping', lambda: decomposer._map_amplitudes_to_keys(dominant_amplitudes))
+        decomposer.chromagram_raw = chromagram_raw
+        decomposer._set_time_axis(decomposer.chromagram_raw.shape[1])
+        decomposer.chromagram = stage('normalize', decomposer._normalize_and_threshold_chromagram)
+
+        visualizer = KeyBoardVisualizer(decomposer)
+        stage('render', lambda: sum(1 for _ in visualizer.iter_frames()))
+        stages['render']['frames'] = int(visualizer.frame_time_points.shape[0])
+
+        if importlib.util.find_spec('moviepy') is None:
+            stages['encode'] = {'skipped': 'moviepy is not installed'}
+        elif encode:
+            stage('encode', lambda: visualizer.build_movie(os.path.join(tmp_dir, 'fixture.mp4')))
+
+        notes = check_notes(decomposer, chords)
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'librosa': librosa.__version__,
+        'fixture': {'seconds': seconds, 'seed': seed, 'chords': len(chords)},
+        'repeat': repeat,
+        'stages': stages,
+        'notes': notes,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seconds', default=30, type=float)
+    parser.add_argument('-r', '--repeat', default=3, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--no_encode', action='store_true')
+    parser.add_argument('--min_recall', default=0.9, type=float)
+    parser.add_argument('--min_precision', default=0.9, type=float)
+    parser.add_argument('-o', '--output', default=None, type=str)
+    args = parser.parse_args()
+
+    report = run_suite(args.seconds, repeat=args.repeat, seed=args.seed, encode=not args.no_encode)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    for metric, minimum in (('recall', args.min_recall), ('precision', args.min_precision)):
+        if report['notes'][metric] < minimum:
+            sys.exit(f'Note {metric} {report["notes"][metric]} is below {minimum}')
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the time to first frame of a job (audio_to_piano.decompose_song) against the length of the song, on
+synthetic songs (see benchmarks.fixtures): the video is rendered as an HLS playlist of segments (see
+KeyBoardVisualizer.build_stream), playable as soon as its first segment is written, instead of once the whole video
+is encoded.
+
+Reports, from the start of the job: the time until the first segment is playable (the 'first_segment' metrics
+stage), and until the whole video is complete (the time to first frame without segments), with the time spent
+decomposing and encoding, and the number of segments.
+
+Run from the repo root: `python -m benchmarks.progressive [--durations 30 120 240]`
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from audio_to_piano import decompose_song
+from benchmarks.fixtures import write_fixture
+from metrics import JobMetrics
+
+
+def measure(seconds, seed=0):
+    """ Render a song of a given length as a stream of segments.
+
+    Returns:
+        dict: times (s) from the start of the job to the first playable segment and to the complete video
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wav_file = os.path.join(tmp_dir, 'progressive.wav')
+        write_fixture(wav_file, seconds, seed=seed)
+        metrics = JobMetrics(job='progressive')
+        start = time.time()
+        decompose_song(wav_file, outname=os.path.join(tmp_dir, 'progressive.mp4'), metrics=metrics, stream=True)
+        complete_s = time.time() - start
+        with open(os.path.join(tmp_dir, 'progressive', 'index.m3u8')) as f:
+            segments = f.read().count('#EXTINF')
+
+    stages = metrics.stages
+    rendering = ('first_segment', 'rasterize', 'render', 'encode')
+    decompose_s = sum(stage.wall_s for name, stage in stages.items() if name not in rendering)
+    return {
+        'seconds': seconds,
+        'segments': segments,
+        'first_segment_s': round(stages['first_segment'].wall_s, 3),
+        'complete_s': round(complete_s, 3),
+        'decompose_s': round(decompose_s, 3),
+        'encode_s': round(stages['encode'].wall_s, 3),
+        'speedup': round(complete_s / stages['first_segment'].wall_s, 2),
+    }
+
+
+def run_suite(durations, seed=0):
+    """ Measure the time to first frame of songs of several lengths.
+
+    Returns:
+        dict: report
+    """
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': seed,
+        'songs': [measure(seconds, seed=seed) for seconds in durations],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--durations', default=[30, 120, 240], type=float, nargs='+')
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('-o', '--output', default=None, type=str)
+    args = parser.parse_args()
+
+    report = run_suite(args.durations, seed=args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
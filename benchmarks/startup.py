@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the cold start of the CLI (audio_to_piano.py). Every run is a fresh interpreter, as when a job is
+spawned per request, in a scratch dir holding a synthetic song (see benchmarks.fixtures). Reports the time from
+spawning the interpreter to the first useful work of:
+- a cache hit: the song is already rendered, the run only has to find it in the catalog (see output_catalog.py) and
+  exit.
+- a cache miss: the first stage of the decomposition (decoding the audio) starts, then the chromagram is done
+  (rendering is left out). The first run starts from an empty numba cache (see chromagram_cache.pin_numba_cache),
+  the others reuse the kernels it compiled.
+Also reports the heavy modules every run imported, and the slowest imports of the DSP stack (python -X importtime).
+
+Run from the repo root: `python -m benchmarks.startup [--repeat 3]`
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# modules worth seconds of startup, a cache hit should import none of them
+HEAVY_MODULES = ('librosa', 'numba', 'scipy', 'pandas', 'PIL', 'psutil', 'youtube_dl', 'moviepy')
+
+SONG = 'startup'
+
+
+def _child(mode):
+    """ Entry point of a benchmarked interpreter. Prints the wall clock time of its milestones, and the heavy
+    modules it imported, as JSON on its last line. """
+    import audio_to_piano
+
+    milestones = {}
+    if mode == 'hit':
+        audio_to_piano.decomposer_pipeline({'song': SONG, 'cache_dir': ''})
+    else:
+        from metrics import JobMetrics
+
+        metrics = JobMetrics(job=SONG)
+        measure_stage = metrics.stage
+
+        def stage(name):
+            milestones.setdefault('first_stage', time.time())
+            return measure_stage(name)
+
+        metrics.stage = stage
+        audio_to_piano.setup_dirs()
+        input_song = audio_to_piano._handle_local_song_option(SONG, audio_to_piano._get_catalog({}))
+
+        from decomposer import Decomposer
+
+        Decomposer(input_song, metrics=metrics).cvt_audio_to_piano()
+        milestones['chromagram'] = time.time()
+
+    milestones['exit'] = time.time()
+    milestones['modules'] = sorted(name for name in HEAVY_MODULES if name in sys.modules)
+    print(json.dumps(milestones))
+
+
+def _spawn(args, cwd, env):
+    """ Run a fresh interpreter.
+
+    Returns:
+        float: wall clock time it was spawned at
+        subprocess.CompletedProcess: finished process
+    """
+    start = time.time()
+    process = subprocess.run(
+        [sys.executable] + args, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+    )
+    return start, process
+
+
+def _interpreter_time(cwd, env):
+    """ Seconds to start and exit a bare interpreter, the floor of any run. """
+    start, _ = _spawn(['-c', 'pass'], cwd, env)
+    return time.time() - start
+
+
+def _run(mode, cwd, env):
+    """ Benchmark a run of the CLI.
+
+    Returns:
+        dict: seconds from spawning the interpreter to every milestone, heavy modules imported
+    """
+    start, process = _spawn(['-m', 'benchmarks.startup', '--child', mode], cwd, env)
+    milestones = json.loads(process.stdout.decode().strip().splitlines()[-1])
+    result = {name: round(t - start, 3) for name, t in milestones.items() if name != 'modules'}
+    result['modules'] = milestones['modules']
+    return result
+
+
+def _best(runs):
+    """ Run with the earliest exit, out of several. """
+    return min(runs, key=lambda run: run['exit'])
+
+
+def import_profile(cwd, env, modules=('decomposer', 'key_board_visualizer'), top=10):
+    """ Slowest imports of modules and of their direct dependencies, from python -X importtime.
+
+    Returns:
+        list: dicts of module name and cumulative import time (s), slowest first
+    """
+    _, process = _spawn(['-X', 'importtime', '-c', f'import {", ".join(modules)}'], cwd, env)
+    imports = []
+    for line in process.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            imports.append({'module': name.strip(), 'cumulative_s': round(int(cumulative) / 1e6, 3)})
+    return sorted(imports, key=lambda x: -x['cumulative_s'])[:top]
+
+
+def run_suite(repeat=3, seconds=10):
+    """ Benchmark cache hit & miss runs of the CLI on a synthetic song.
+
+    Returns:
+        dict: report
+    """
+    from benchmarks.fixtures import write_fixture
+    from output_catalog import OutputCatalog
+
+    repo = os.getcwd()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [repo, os.environ.get('PYTHONPATH')])))
+    with tempfile.TemporaryDirectory() as scratch:
+        numba_dir = os.path.join(scratch, 'cache', 'numba')
+        env['NUMBA_CACHE_DIR'] = numba_dir  # empty at first, unlike the repo's
+        os.symlink(os.path.join(repo, 'assets'), os.path.join(scratch, 'assets'))
+        for directory in ('input', 'output'):
+            os.mkdir(os.path.join(scratch, directory))
+        write_fixture(os.path.join(scratch, 'input', SONG + '.wav'), seconds)
+
+        interpreter = min(_interpreter_time(scratch, env) for _ in range(repeat))
+        misses = [_run('miss', scratch, env) for _ in range(repeat + 1)]
+        numba_files = sum(len(files) for _, _, files in os.walk(numba_dir))
+
+        video_path = os.path.join(scratch, 'output', SONG + '.mp4')
+        open(video_path, 'w').close()
+        OutputCatalog(os.path.join(scratch, 'output', 'catalog.sqlite')).add_output(SONG, video_path)
+        hit = _best([_run('hit', scratch, env) for _ in range(repeat)])
+        imports = import_profile(scratch, env)
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'interpreter_s': round(interpreter, 3),
+        'hit': hit,
+        'miss_cold_numba': misses[0],
+        'miss': _best(misses[1:]),
+        'numba_cache_files': numba_files,
+        'imports': imports,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repeat', default=3, type=int)
+    parser.add_argument('-s', '--seconds', default=10, type=float)
+    parser.add_argument('-o', '--output', default=None, type=str)
+    parser.add_argument('--child', default=None, choices=['hit', 'miss'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child)
+        sys.exit()
+
+    report = run_suite(repeat=args.repeat, seconds=args.seconds)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
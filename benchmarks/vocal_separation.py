@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the vocal separation (Decomposer._spectrogram_separate_vocals) against the length of the song: the
+windowed nearest-neighbour filter (signal_process_utils.windowed_nn_filter, neighbours within --window seconds)
+versus librosa's nn_filter over the whole song, on the harmonic spectrograms of synthetic songs (see
+benchmarks.fixtures).
+
+Reports the wall time and peak memory (tracemalloc) of both, the note accuracy of the chromagrams of their
+foreground & background (see benchmarks.pipeline.check_notes), and how close the windowed foreground & background
+are to librosa's: relative error (||windowed - exact|| / ||exact||) and the fraction of identical frames. The
+fixtures never repeat themselves, so the neighbours of a frame are merely similar frames, which depend on how far
+they are searched: the spectrograms only match on songs shorter than the window, the notes should match on all.
+The exact filter is only run up to --max_exact seconds, it grows quadratically.
+
+Run from the repo root: `python -m benchmarks.vocal_separation [--durations 30 60 120 240] [--window 30]`
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import write_fixture
+from benchmarks.pipeline import _measure, check_notes
+from decomposer import Decomposer
+
+
+def _closeness(actual, expected):
+    """ Relative error and fraction of identical frames of a spectrogram. """
+    return {
+        'relative_error': round(float(np.linalg.norm(actual - expected) / np.linalg.norm(expected)), 5),
+        'identical_frames': round(float(np.mean(np.all(actual == expected, axis=0))), 4),
+    }
+
+
+def _notes(decomposer, spectrogram, chords):
+    """ Note check of the chromagram of a spectrogram. """
+    dominant_amplitudes = decomposer._find_dominant_amplitudes(spectrogram)
+    decomposer.chromagram_raw = decomposer._map_amplitudes_to_keys(dominant_amplitudes)
+    decomposer.chromagram = decomposer._normalize_and_threshold_chromagram()
+    return check_notes(decomposer, chords)
+
+
+def compare(seconds, window=30, neighbours=None, repeat=1, exact=True, seed=0):
+    """ Separate the vocals of a song of a given length, windowed and (optionally) exact.
+
+    Returns:
+        dict: timings, peak memory and note checks of both separations, closeness of the windowed one to the
+            exact one
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wav_file = os.path.join(tmp_dir, 'fixture.wav')
+        chords = write_fixture(wav_file, seconds, seed=seed)
+        decomposer = Decomposer(wav_file)
+        spec_harmonic = decomposer.spec_harmonic
+
+    decomposer.vocal_neighbours = neighbours
+    result = {'seconds': seconds, 'frames': spec_harmonic.shape[1]}
+    separations = {}
+    for name, vocal_window in (('windowed', window), ('exact', None)):
+        if name == 'exact' and not exact:
+            continue
+        decomposer.vocal_window = vocal_window
+        separations[name], result[name] = _measure(
+            lambda: decomposer._spectrogram_separate_vocals(spec_harmonic), repeat
+        )
+        decomposer._set_time_axis(spec_harmonic.shape[1])
+        for i, part in enumerate(('foreground', 'background')):
+            result[name][f'{part}_notes'] = _notes(decomposer, separations[name][i], chords)
+
+    if 'exact' in separations:
+        for i, part in enumerate(('foreground', 'background')):
+            result['windowed'][part] = _closeness(separations['windowed'][i], separations['exact'][i])
+        result['speedup'] = round(result['exact']['wall_s'] / result['windowed']['wall_s'], 2)
+    return result
+
+
+def run_suite(durations, window=30, neighbours=None, max_exact=240, repeat=1, seed=0):
+    """ Compare windowed and exact vocal separation over songs of several lengths.
+
+    Returns:
+        dict: report
+    """
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'window_s': window,
+        'neighbours': neighbours,
+        'repeat': repeat,
+        'songs': [
+            compare(seconds, window, neighbours, repeat=repeat, exact=seconds <= max_exact, seed=seed)
+            for seconds in durations
+        ],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--durations', default=[30, 60, 120, 240], type=float, nargs='+')
+    parser.add_argument('-w', '--window', default=30, type=float)
+    parser.add_argument('-k', '--neighbours', default=None, type=int)
+    parser.add_argument('--max_exact', default=240, type=float)
+    parser.add_argument('-r', '--repeat', default=1, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('-o', '--output', default=None, type=str)
+    args = parser.parse_args()
+
+    report = run_suite(
+        args.durations, window=args.window, neighbours=args.neighbours, max_exact=args.max_exact,
+        repeat=args.repeat, seed=args.seed
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
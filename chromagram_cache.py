@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import sys
+import zipfile
+
+import numpy as np
+
+# logger with special stream handling to output to stdout in Node.js
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+stdout_handler.setLevel(logging.INFO)
+# logger.addHandler(stdout_handler)
+
+# bump whenever the decomposition algorithm changes its output, to invalidate existing artifacts
+CACHE_VERSION = 2
+# librosa's numba kernels are compiled with cache=True, into the installed package or the user's cache dir. Where
+# neither is writable (e.g. containers), every process compiles them again, which takes seconds: pin the cache to
+# the repo's cache dir instead (whatever the working dir), see pin_numba_cache.
+NUMBA_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'numba')
+
+
+class ChromagramCache(object):
+    def __init__(self, cache_dir='cache', max_size=1024):
+        """ On-disk cache of intermediate decomposition artifacts (spectrograms, raw chromagrams).
+        Artifacts are content addressed: keyed by a hash of the audio file's bytes plus the exact parameters
+        they were computed with, so renamed copies of a song hit the same entries. Every artifact is a
+        compressed .npz file. Once the cache exceeds max_size, the least recently used artifacts are evicted.
+
+        Several processes may share a cache dir: artifacts are written atomically, and an artifact
+        evicted while being read is treated as a miss.
+
+        Args:
+            cache_dir (str): directory to store artifacts in
+            max_size (float): max total size of the artifacts in MB
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    @staticmethod
+    def hash_file(path, chunk_size=1 << 20):
+        """ Content hash (sha256 hex digest) of a file. """
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(audio_hash, stage, params):
+        """ Key of an artifact.
+
+        Args:
+            audio_hash (str): content hash of the audio file, see hash_file
+            stage (str): name of the artifact, e.g. 'raw' or 'chromagram'
+            params (dict): every parameter the artifact depends on. Values must be JSON serializable.
+        Returns:
+            str: key
+        """
+        spec = json.dumps([CACHE_VERSION, audio_hash, stage, params], sort_keys=True)
+        return f'{stage}-{hashlib.sha256(spec.encode()).hexdigest()}'
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        """ Load an artifact, and mark it as recently used.
+
+        Args:
+            key (str): see self.key
+        Returns:
+            dict or None: arrays of the artifact by name, None on a cache miss
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as artifact:
+                arrays = {name: artifact[name] for name in artifact.files}
+            os.utime(path)
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            return None
+        logger.info(f'[CACHE] >>>> Hit {key}.')
+        return arrays
+
+    def save(self, key, arrays):
+        """ Store an artifact, then evict the least recently used artifacts if the cache is over its max size.
+
+        Args:
+            key (str): see self.key
+            arrays (dict): arrays of the artifact by name
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+        logger.info(f'[CACHE] >>>> Stored {key} ({os.path.getsize(path) / 1e6:.2f}MB).')
+        self.evict()
+
+    def evict(self):
+        """ Delete the least recently used artifacts until the cache fits in self.max_size. """
+        artifacts = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # evicted by another process
+                    continue
+                artifacts.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(artifact_size for _, artifact_size, _ in artifacts)
+        for _, artifact_size, path in sorted(artifacts):
+            if size <= self.max_size * 1e6:
+                break
+            try:
+                os.remove(path)
+                logger.info(f'[CACHE] >>>> Evicted {os.path.basename(path)}.')
+            except FileNotFoundError:
+                pass
+            size -= artifact_size
+
+
+def pin_numba_cache():
+    """ Cache the numba kernels in NUMBA_CACHE_DIR, unless the NUMBA_CACHE_DIR env var is set already. numba reads it
+    once, when it is imported: entry points must call this before importing librosa (or the decomposer). """
+    os.environ.setdefault('NUMBA_CACHE_DIR', NUMBA_CACHE_DIR)
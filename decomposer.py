@@ -3,13 +3,19 @@
 import logging
 import sys
 from functools import partial
+from math import gcd
 
 import librosa
 import numpy as np
-from scipy.signal import find_peaks
-from tqdm import tqdm
+from scipy.ndimage import median_filter
 
-from signal_process_utils import generate_frequency_table, get_memory_usage
+from media_ingest import decode_audio
+from metrics import JobMetrics
+from note_events import extract_notes
+from signal_process_utils import (
+    find_peaks_2d, get_memory_usage, key_filterbank, key_geometry, map_frequencies_to_keys, tiled_apply,
+    windowed_nn_filter
+)
 
 # logger with special stream handling to output to stdout in Node.js
 logging.basicConfig(level=logging.INFO)
@@ -21,50 +27,188 @@ stdout_handler.setLevel(logging.INFO)
 
 
 class Decomposer(object):
-    def __init__(self, wav_file=None, stop_time=None):
+    # spectrogram types, and the type each one is derived from
+    _spectrogram_parents = {
+        'raw': None,
+        'harmonic': 'raw',
+        'percussive': 'raw',
+        'foreground': 'harmonic',
+        'background': 'harmonic',
+    }
+    # spectral front ends, see self._raw_spectrogram
+    front_ends = ('stft', 'filterbank', 'cqt')
+
+    def __init__(
+        self, wav_file=None, stop_time=None, block_duration=None, cache=None, metrics=None, front_end='stft'
+    ):
         """ Class to decompose an wav file into its frequency vs. time spectrogram,
         and map that to piano keys.
 
         Args:
-            wav_file (str): name of wav file to process.
+            wav_file (str): name of wav file to process. Any media file ffmpeg can decode works too, but streaming
+                requires a format soundfile can read (wav, flac, ogg).
             stop_time (float): end time to trim song to
+            block_duration (float or None): if set, stream the wav file in blocks of this many seconds
+                instead of loading it whole. Keeps peak memory bounded for long recordings.
+            cache (chromagram_cache.ChromagramCache or None): if set, spectrograms and the raw chromagram are
+                looked up in/stored to this on-disk cache. The audio is then only loaded on a cache miss.
+            metrics (metrics.JobMetrics or None): per-job metrics every stage of the pipeline is recorded into.
+                Default: a new JobMetrics, which is not exported.
+            front_end (str): {stft, filterbank or cqt}. Default: 'stft'. Spectrogram the pipeline runs on:
+                stft: linear frequency STFT (1025 bins), whose peaks are then mapped to the nearest key.
+                filterbank: the STFT summed into one bin per key (see signal_process_utils.key_filterbank).
+                cqt: constant-Q transform, one bin per key (12 per octave from A0).
+                The 88 bin front ends give low keys a bin of their own, and peak picking and the spectrogram
+                separations run on 88 instead of 1025 rows.
         """
+        if front_end not in self.front_ends:
+            raise ValueError(f'Given front_end argument is not valid: {front_end}')
         self.wav_file = wav_file
         self.stop_time = stop_time
+        self.block_duration = block_duration
+        self.cache = cache
+        self.metrics = metrics or JobMetrics()
+        self.front_end = front_end
+        self._audio_hash = None  # content hash of wav_file, see self._cache_key
+        self._spectrograms = {}  # cache of spectrogram types, see self._resolve_spectrogram
 
         # hardcoded constants
         self.max_freq = 4186        # Hz of high c (key 88). Sample rate is double (Nyquist Sampling Theorem).
         self.last_key_num = 89      # using a standard 88 key piano
         self.n_fft = 2048           # FFT window size for STFT spectrogram
         self.norm_algo = 'div_max'  # algorithm to normalize spectral vectors
+        self.spec_type = 'harmonic'  # type of spectrogram to map to piano, see self._select_spectrogram
         self.amp_thresh = 0.3       # float [0, 1] threshold normalized amplitudes must exceed to be mapped to piano
+        self.peak_prominence = 3    # min prominence of a peak in the log spectrogram to count as dominant frequency
+        if front_end != 'stft':
+            self.peak_prominence = 0.5  # neighbouring keys are neighbouring bins: peaks stand out less
+        self.stream_halo = 64       # frames of context on each side of a streamed block
+        self.vocal_window = 30      # s, max distance of similar frames in vocal separation. None: whole song
+        self.vocal_neighbours = None  # similar frames per frame in vocal separation. None: librosa's default
+        self.tile_frames = 1024     # frames per tile of HPSS, see self._hpss
+        self.tile_workers = 1       # workers HPSS tiles are spread over (threads, or processes), see self._hpss
+        self.tile_executor = 'thread'  # {thread or process}, see signal_process_utils.tiled_apply
+        self.keep_spectrograms = False  # cache every computed spectrogram type (e.g. for plotting)
+        self.dtype = np.float32     # of spectrograms & chromagrams. np.float64 doubles memory for no audible gain
 
         # raw audio/acoustic data
-        self.audio_ts, self.sample_rate = librosa.load(wav_file, sr=self.max_freq * 2, duration=self.stop_time)
-        self.duration = librosa.get_duration(self.audio_ts, sr=self.sample_rate)
-        self.freq_table = generate_frequency_table()
-
-        def _find_nearest(value, array):
-            """ Quantize a value (detected frequency) to piano's nearest fundemental frequency."""
-            idx = np.argmin(np.abs(array - value))
-            return self.last_key_num - idx
-
-        self._map_freq2note = np.vectorize(partial(_find_nearest, array=self.freq_table['Frequency (Hz)'].values))
+        self.sample_rate = self.max_freq * 2
+        self._audio_ts = None
+        if self.block_duration:
+            self._open_stream()
+        elif self.cache is None:
+            self._load_audio()
+        self.key_frequencies = key_geometry()['frequencies']  # of the piano keys, key 88 first
+
+        # bin frequencies are fixed by sample rate and n_fft: map each bin to its piano key once
+        self.freqs = librosa.fft_frequencies(sr=self.sample_rate, n_fft=self.n_fft)
+        if front_end == 'stft':
+            bin2key = self.last_key_num - map_frequencies_to_keys(self.freqs, self.key_frequencies)
+        else:
+            # one bin per key, lowest key first
+            bin2key = self.last_key_num - np.arange(self.key_frequencies.size)[::-1]
+            self._filterbank = key_filterbank(self.freqs, self.key_frequencies[::-1])
+        self._key_numbers, self._key_bin_starts = np.unique(bin2key, return_index=True)
 
     def cvt_audio_to_piano(self):
         """ Apply the audio file to visual piano representation pipeline. """
 
         logger.info(f'[DECOMPOSER] >>>> Beginning pipeline. MEM: {get_memory_usage()}')
-        self._generate_spectrogram()
-        logger.info(f'[DECOMPOSER] >>>> _generate_spectrogram. MEM: {get_memory_usage()}')
-        self._select_spectrogram()
-        logger.info(f'[DECOMPOSER] >>>> _select_spectrogram. MEM: {get_memory_usage()}')
-        self._parse_spectrogram()
-        logger.info(f'[DECOMPOSER] >>>> _parse_spectrogram. MEM: {get_memory_usage()}')
+        cached = self._load_cached('chromagram')
+        if cached is not None:
+            # only the normalization and threshold are left to apply
+            self._set_time_axis(int(cached['n_frames']))
+            self.chromagram_raw = cached['chromagram_raw'].astype(self.dtype, copy=False)
+            self.chromagram = self._normalize_and_threshold_chromagram()
+            logger.info(f'[DECOMPOSER] >>>> Loaded raw chromagram from cache. MEM: {get_memory_usage()}')
+            return
+
+        if self.block_duration:
+            self._parse_spectrogram_streaming(self.spec_type)
+            logger.info(f'[DECOMPOSER] >>>> _parse_spectrogram_streaming. MEM: {get_memory_usage()}')
+        else:
+            self._generate_spectrogram()
+            logger.info(f'[DECOMPOSER] >>>> _generate_spectrogram. MEM: {get_memory_usage()}')
+            self._select_spectrogram(self.spec_type)
+            logger.info(f'[DECOMPOSER] >>>> _select_spectrogram. MEM: {get_memory_usage()}')
+            self._parse_spectrogram()
+            logger.info(f'[DECOMPOSER] >>>> _parse_spectrogram. MEM: {get_memory_usage()}')
+
+        # raw chromagram values are float32 amplitudes, so storing them as float32 is lossless
+        self._store_cached(
+            'chromagram',
+            chromagram_raw=self.chromagram_raw.astype(np.float32, copy=False),
+            n_frames=self.times.shape[0]
+        )
+
+    @property
+    def audio_ts(self):
+        """ np.ndarray: audio time series, loaded on first access. """
+        if self._audio_ts is None:
+            self._load_audio()
+        return self._audio_ts
+
+    def _load_audio(self):
+        """ Decode the whole wav file (up to self.stop_time) straight to mono at self.sample_rate. """
+        with self.metrics.stage('load') as stage:
+            self._audio_ts = decode_audio(self.wav_file, self.sample_rate, duration=self.stop_time)
+            stage.record(audio_ts=self._audio_ts)
+        self.duration = librosa.get_duration(self._audio_ts, sr=self.sample_rate)
+
+    def _cache_key(self, stage):
+        """ Key of a cached artifact: content hash of the wav file plus every parameter the artifact depends on.
+        The normalization and threshold are applied after the cached stages, so they are not part of any key.
+
+        Args:
+            stage (str): {raw, harmonic, percussive, foreground, background or chromagram}
+        Returns:
+            str: key, see ChromagramCache.key
+        """
+        if self._audio_hash is None:
+            self._audio_hash = self.cache.hash_file(self.wav_file)
+        params = {
+            'sample_rate': self.sample_rate, 'n_fft': self.n_fft, 'stop_time': self.stop_time,
+            'front_end': self.front_end,
+        }
+        vocal_separated = ('foreground', 'background')
+        if stage in vocal_separated or (stage == 'chromagram' and self.spec_type in vocal_separated):
+            params.update(vocal_window=self.vocal_window, vocal_neighbours=self.vocal_neighbours)
+        if stage == 'chromagram':
+            params.update(
+                spec_type=self.spec_type,
+                peak_prominence=self.peak_prominence,
+                last_key_num=self.last_key_num,
+                block_duration=self.block_duration,
+                stream_halo=self.stream_halo if self.block_duration else None,
+            )
+        return self.cache.key(self._audio_hash, stage, params)
+
+    def _load_cached(self, stage):
+        """ Load an artifact from self.cache, restoring the song duration it was computed with.
+
+        Args:
+            stage (str): see self._cache_key
+        Returns:
+            dict or None: arrays of the artifact, None on a cache miss or without a cache
+        """
+        if self.cache is None:
+            return None
+        with self.metrics.stage('cache_load'):
+            arrays = self.cache.load(self._cache_key(stage))
+        if arrays is not None:
+            self.duration = float(arrays['duration'])
+        return arrays
+
+    def _store_cached(self, stage, **arrays):
+        """ Store an artifact in self.cache (if any), along with the song duration. """
+        if self.cache is not None:
+            with self.metrics.stage('cache_store'):
+                self.cache.save(self._cache_key(stage), dict(arrays, duration=self.duration))
 
     @staticmethod
     def _normalize_filter(matrix, axis=0, algo='div_max'):
-        """ Normalize matrix along a given axis.
+        """ Normalize matrix along a given axis. Vectors of zeros (or of a single value, for zero_one) are
+        normalized to zeros.
 
         Args:
             matrix (np.ndarray): matrix to normalize
@@ -72,67 +216,207 @@ class Decomposer(object):
             algo (str): {div_max or zero_one}. Default div_max.
                 div_max: divide all values by max in vector:x/max(x)
                 zero_one: scale vector between [0-1]: (x - min(x)) / (max(x) - min(x))
+        Returns:
+            np.ndarray: normalized matrix, same shape as matrix
         """
-        norm_algo = {
-            'div_max': lambda x: x / max(x),
-            'zero_one': lambda x: (x - min(x)) / (max(x) - min(x))
-        }
-        normalized = np.apply_along_axis(
-            norm_algo[algo],
-            axis=axis,
-            arr=matrix
-        )
-        normalized[np.isnan(normalized)] = 0
-        return normalized
+        if algo == 'div_max':
+            numerator, denominator = matrix, matrix.max(axis=axis, keepdims=True)
+        elif algo == 'zero_one':
+            low = matrix.min(axis=axis, keepdims=True)
+            numerator, denominator = matrix - low, matrix.max(axis=axis, keepdims=True) - low
+        else:
+            raise ValueError(f'Given algo argument is not valid: {algo}')
+        return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
 
     @staticmethod
-    def _median_filter(arr, length=5, stride=1):
-        """ Compute the 1D median filter of an array. This helps remove outliers and noise.
+    def _median_filter(matrix, length=5, block_rows=128):
+        """ Compute the median filter of every row of a matrix along the time axis (axis 1), in place.
+        This helps remove outliers and noise. Each value is replaced by the median of itself and the
+        (length - 1) values before it, the first (length - 1) values of a row are left as is.
+
+        The default window of 5 uses a min/max selection network over shifted views of the matrix,
+        other window sizes fall back to scipy.ndimage.median_filter.
 
         Args:
-            arr (np.ndarray): arr to filter
-            length (int): window size
-            stride (int): step size
+            matrix (np.ndarray): 2D matrix to filter (e.g. spectrogram, frequency x time)
+            length (int): window size, odd
+            block_rows (int): number of rows filtered at once, bounds the size of the temporary arrays
 
         Returns:
-            smoothed np.ndarray
+            smoothed np.ndarray (the same object as matrix)
         """
-        nrows = ((arr.size - length) // stride) + 1
-        n = arr.strides[0]
-        windowed_matrix = np.lib.stride_tricks.as_strided(arr, shape=(nrows, length), strides=(stride * n, n))
-        median = np.median(windowed_matrix, axis=1)
-        arr[-median.shape[0] :] = median
-        return arr
+        n_cols = matrix.shape[1]
+        for row in range(0, matrix.shape[0], block_rows):
+            block = matrix[row: row + block_rows]
+            if length == 5:
+                # median of 5: discard the min and max of a-d pairwise, then take the median of 3 with e
+                a, b, c, d, e = (block[:, k: n_cols - 4 + k] for k in range(5))
+                low = np.maximum(np.minimum(a, b), np.minimum(c, d))
+                high = np.minimum(np.maximum(a, b), np.maximum(c, d))
+                filtered = np.maximum(np.minimum(e, low), np.minimum(np.maximum(e, low), high))
+            else:
+                filtered = median_filter(block, size=(1, length), origin=(0, (length - 1) // 2))[:, length - 1:]
+            block[:, length - 1:] = filtered
+        return matrix
 
     def _generate_spectrogram(self):
         """ Generate & filter spectrogram, generate corresponding time and frequency alignment vectors.
         Spectrogram generated by librosa's STFT using {self.n_fft} FFT window size, custom median
         filter is applied along the time axis.
-        Performs Harmonic-Percussive Source Separation (HPSS) on this filtered STFT.
-        Performs Vocal Separation on this HPSS filtered STFT. """
+        HPSS and Vocal Separation are only performed on demand, see self._resolve_spectrogram. With a cache,
+        so is the STFT: it is skipped altogether if the selected spectrogram is cached. """
 
-        self.spec_raw, phase = librosa.magphase(librosa.stft(self.audio_ts, self.n_fft))
-        self.times = np.linspace(0, self.duration, self.spec_raw.shape[1])
-        self.freqs = librosa.fft_frequencies(sr=self.sample_rate, n_fft=self.n_fft)
+        self._spectrograms = {}
+        if self.cache is None:
+            self._set_time_axis(self.spec_raw.shape[1])
+            logger.info('[DECOMPOSER] >>>> Generated raw spectrogram.')
 
-        logger.info('[DECOMPOSER] >>>> Generated raw spectrogram.')
+    def _raw_spectrogram(self, audio_ts, center=True):
+        """ Magnitude spectrogram of self.front_end (phase is never computed), median filtered along the time axis.
 
-        if self.stop_time:
-            self.t_final = np.where(self.times < self.stop_time)[0][-1]
+        Args:
+            audio_ts (np.ndarray): audio time series
+            center (bool): passed onto librosa.stft
+
+        Returns:
+            np.ndarray: filtered spectrogram
+        """
+        audio_ts = audio_ts.astype(self.dtype, copy=False)
+        if self.front_end == 'cqt':
+            with self.metrics.stage('cqt') as stage:
+                spec_raw = self._cqt(audio_ts, center=center)
+                stage.record(spec_raw=spec_raw)
         else:
-            self.t_final = self.times.shape[0]
+            with self.metrics.stage('stft') as stage:
+                spec_raw = np.abs(librosa.stft(audio_ts, n_fft=self.n_fft, center=center))
+                stage.record(spec_raw=spec_raw)
+        if self.front_end == 'filterbank':
+            with self.metrics.stage('filterbank') as stage:
+                # transposed product, to keep the Fortran order of the STFT (see self._hpss)
+                spec_raw = (spec_raw.T @ self._filterbank.T).T.astype(self.dtype, copy=False)
+                stage.record(spec_raw=spec_raw)
 
         # median filter along time axis to get rid of white noise
-        self.spec_raw = np.apply_along_axis(self._median_filter, 1, self.spec_raw)
+        with self.metrics.stage('median_filter') as stage:
+            spec_raw = self._median_filter(spec_raw)
+            stage.record(spec_raw=spec_raw)
+        return spec_raw
+
+    def _cqt(self, audio_ts, center=True):
+        """ Constant-Q magnitude spectrogram with one bin per key, lowest key first, on the time axis of the STFT.
+        The filter of the top key would reach past the Nyquist frequency (its frequency is half the sample rate),
+        so its bin is left at zero.
+
+        Args:
+            audio_ts (np.ndarray): audio time series
+            center (bool): as in librosa.stft: frame t is centered on sample t * hop, else it starts there
+
+        Returns:
+            np.ndarray: spectrogram (key x time)
+        """
+        hop = self.n_fft // 4
+        n_bins = self.key_frequencies.size - 1
+        cqt = np.abs(librosa.cqt(
+            audio_ts, sr=self.sample_rate, hop_length=hop, fmin=self.key_frequencies[-1], n_bins=n_bins,
+            bins_per_octave=12, tuning=0.0, pad_mode='reflect'  # as librosa.stft pads, and as blocks are read
+        ))
+        if not center:
+            # librosa.cqt always centers its frames: drop the ones an uncentered STFT would not have
+            cqt = cqt[:, self.n_fft // hop // 2: cqt.shape[1] - self.n_fft // hop // 2]
+        spectrogram = np.zeros((n_bins + 1, cqt.shape[1]), dtype=self.dtype, order='F')
+        spectrogram[:n_bins] = cqt
+        return spectrogram
+
+    def _resolve_spectrogram(self, spec_type, spectrograms):
+        """ Get a type of spectrogram from a cache, computing it (and the spectrograms it depends on) if needed.
+        Dependencies: raw -> harmonic/percussive (HPSS) -> foreground/background (Vocal Separation).
+
+        Unless self.keep_spectrograms is set, only the requested spectrogram is cached: its parent is
+        freed as soon as it has been derived, and so is the sibling computed alongside it.
+        Spectrograms of the whole song (self._spectrograms) are also looked up in/stored to self.cache.
+
+        Args:
+            spec_type (str): {raw, harmonic, percussive, foreground or background}
+            spectrograms (dict): cache of spectrograms by type, updated in place
 
-        # apply additonal spectrogram maniplation
-        self.spec_harmonic, self.spec_percussive = librosa.decompose.hpss(self.spec_raw, margin=2)
-        self.spec_foreground, self.spec_background = self._spectrogram_separate_vocals(self.spec_harmonic)
+        Returns:
+            np.ndarray: spectrogram of the given type
+        """
+        if spec_type in spectrograms:
+            return spectrograms[spec_type]
+        persist = spectrograms is self._spectrograms
+        if persist:
+            cached = self._load_cached(spec_type)
+            if cached is not None:
+                spectrograms[spec_type] = cached['spectrogram']
+                return spectrograms[spec_type]
+
+        parent = self._spectrogram_parents[spec_type]
+        if parent is None:
+            derived = {'raw': self._raw_spectrogram(self.audio_ts)}
+        elif parent == 'raw':
+            spec_raw = self._resolve_spectrogram(parent, spectrograms)
+            with self.metrics.stage('hpss') as stage:
+                spec_harmonic, spec_percussive = self._hpss(spec_raw, margin=2)
+                stage.record(spec_harmonic=spec_harmonic, spec_percussive=spec_percussive)
+            derived = {'harmonic': spec_harmonic, 'percussive': spec_percussive}
+            logger.info('[DECOMPOSER] >>>> Perfomed HPSS.')
+        else:
+            spec_harmonic = self._resolve_spectrogram(parent, spectrograms)
+            with self.metrics.stage('vocal_separation') as stage:
+                spec_foreground, spec_background = self._spectrogram_separate_vocals(spec_harmonic)
+                stage.record(spec_foreground=spec_foreground, spec_background=spec_background)
+            derived = {'foreground': spec_foreground, 'background': spec_background}
+
+        if not self.keep_spectrograms:
+            spectrograms.pop(parent, None)
+            derived = {spec_type: derived[spec_type]}
+        spectrograms.update(derived)
+        if persist:
+            self._store_cached(spec_type, spectrogram=spectrograms[spec_type])
+        return spectrograms[spec_type]
+
+    @property
+    def spec_raw(self):
+        """ np.ndarray: median filtered STFT spectrogram. """
+        return self._resolve_spectrogram('raw', self._spectrograms)
+
+    @property
+    def spec_harmonic(self):
+        """ np.ndarray: harmonic component of spec_raw (HPSS). """
+        return self._resolve_spectrogram('harmonic', self._spectrograms)
+
+    @property
+    def spec_percussive(self):
+        """ np.ndarray: percussive component of spec_raw (HPSS). """
+        return self._resolve_spectrogram('percussive', self._spectrograms)
+
+    @property
+    def spec_foreground(self):
+        """ np.ndarray: foreground (voice) of spec_harmonic (Vocal Separation). """
+        return self._resolve_spectrogram('foreground', self._spectrograms)
+
+    @property
+    def spec_background(self):
+        """ np.ndarray: background (harmonics) of spec_harmonic (Vocal Separation). """
+        return self._resolve_spectrogram('background', self._spectrograms)
+
+    def _set_time_axis(self, n_frames):
+        """ Set the time alignment vector of the spectrogram, and the number of frames to parse.
 
-        logger.info('[DECOMPOSER] >>>> Perfomed HPSS and Vocal Separation.')
+        Args:
+            n_frames (int): number of STFT frames of the whole song
+        """
+        self.times = np.linspace(0, self.duration, n_frames)
+        if self.stop_time:
+            self.t_final = np.where(self.times < self.stop_time)[0][-1]
+        else:
+            self.t_final = self.times.shape[0]
 
     def _spectrogram_separate_vocals(self, spectrogram):
-        """ Use Librosa's nearest-neighbor-filtering to separate voice from background of spectrogram.
+        """ Use nearest-neighbor-filtering to separate voice from background of spectrogram: the background is
+        what a frame has in common with the most similar frames within self.vocal_window seconds (see
+        signal_process_utils.windowed_nn_filter), or within the whole song with Librosa's nn_filter.
 
         Args:
             spectrogram (np.ndarray): spectrogram to process.
@@ -142,121 +426,279 @@ class Decomposer(object):
             np.ndarray: spectrogram of background (harmonics)
 
         """
-        s_filter = librosa.decompose.nn_filter(
-            spectrogram,
-            aggregate=np.median,
-            metric='cosine',
-            width=int(librosa.time_to_frames(2, sr=self.sample_rate))
-        )
+        width = int(librosa.time_to_frames(2, sr=self.sample_rate, hop_length=self.n_fft // 4))
+        if self.vocal_window is None:
+            # compares every pair of frames: time & memory grow quadratically with the length of the song
+            s_filter = librosa.decompose.nn_filter(
+                spectrogram, aggregate=np.median, metric='cosine', width=width, k=self.vocal_neighbours
+            )
+        else:
+            window = int(librosa.time_to_frames(self.vocal_window, sr=self.sample_rate, hop_length=self.n_fft // 4))
+            s_filter = windowed_nn_filter(spectrogram, width, window, k=self.vocal_neighbours)
 
-        s_filter = np.minimum(spectrogram, s_filter)
+        np.minimum(spectrogram, s_filter, out=s_filter)
+        s_residual = spectrogram - s_filter
         margin_i, margin_v, power = 2, 10, 2
 
-        mask_i = librosa.util.softmask(s_filter, margin_i * (spectrogram - s_filter), power=power)
-
-        mask_v = librosa.util.softmask(spectrogram - s_filter, margin_v * s_filter, power=power)
+        s_background = self._apply_softmask(spectrogram, np.copy(s_filter), margin_i * s_residual, power)
 
-        s_foreground = mask_v * spectrogram
-        s_background = mask_i * spectrogram
+        # last use of the filter and the residual: mask in place
+        s_filter *= margin_v
+        s_foreground = self._apply_softmask(spectrogram, s_residual, s_filter, power)
 
         logger.info(f'[DECOMPOSER] >>>> Separated vocals from spectrogram.')
 
         return s_foreground, s_background
 
+    def _hpss(self, spectrogram, margin=2, kernel_size=31, power=2):
+        """ Harmonic Percussive Source Separation: librosa.decompose.hpss on a magnitude spectrogram, with its masks
+        applied in place (see self._apply_softmask).
+
+        The spectrogram is split into tiles of self.tile_frames frames, separated on self.tile_workers workers (see
+        signal_process_utils.tiled_apply). Every tile gets kernel_size // 2 frames of context on each side for the
+        harmonic median filter, so the result is identical to separating the whole spectrogram at once.
+
+        Args:
+            spectrogram (np.ndarray): magnitude spectrogram (frequency x time)
+            margin (float): margin of both masks, >= 1
+            kernel_size (int): length of the median filters, along time (harmonic) and frequency (percussive)
+            power (float): exponent of the soft masks
+
+        Returns:
+            np.ndarray: harmonic spectrogram
+            np.ndarray: percussive spectrogram
+        """
+        return tiled_apply(
+            partial(self._hpss_tile, margin=margin, kernel_size=kernel_size, power=power), spectrogram,
+            halo=kernel_size // 2, tile_frames=self.tile_frames, workers=self.tile_workers, executor=self.tile_executor
+        )
+
+    @staticmethod
+    def _hpss_tile(spectrogram, margin, kernel_size, power):
+        """ HPSS of a tile of a spectrogram, see self._hpss.
+
+        Returns:
+            tuple: harmonic & percussive spectrograms of the tile
+        """
+        # filter into arrays of the spectrogram's memory layout (Fortran order out of the STFT): nn_filter (vocal
+        # separation) is several times slower on C ordered spectrograms
+        harm, perc = np.empty_like(spectrogram), np.empty_like(spectrogram)
+        median_filter(spectrogram, size=(1, kernel_size), mode='reflect', output=harm)
+        median_filter(spectrogram, size=(kernel_size, 1), mode='reflect', output=perc)
+
+        spec_harmonic = Decomposer._apply_softmask(spectrogram, np.copy(harm), perc * margin, power)
+
+        # last use of the median filtered spectrograms: mask in place
+        harm *= margin
+        spec_percussive = Decomposer._apply_softmask(spectrogram, perc, harm, power)
+        return spec_harmonic, spec_percussive
+
+    @staticmethod
+    def _apply_softmask(spectrogram, x, x_ref, power):
+        """ Mask a spectrogram with librosa.util.softmask(x, x_ref, power), without its temporary arrays:
+        x and x_ref are overwritten, x with the masked spectrogram.
+
+        Returns:
+            np.ndarray: masked spectrogram (the same object as x)
+        """
+        # same operations as librosa.util.softmask, so the result is identical
+        z = np.maximum(x, x_ref)
+        bad_idx = z < np.finfo(z.dtype).tiny
+        z[bad_idx] = 1
+        x /= z
+        x **= power
+        x_ref /= z
+        x_ref **= power
+        del z
+        x_ref += x
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x /= x_ref
+        x[bad_idx] = 0
+        x *= spectrogram
+        return x
+
     def _select_spectrogram(self, spec_type='harmonic'):
-        """ Select type of spectrogram to use (raw, harmonic or percussive - generated by HPSS).
+        """ Select type of spectrogram to use (raw, harmonic or percussive - generated by HPSS,
+        foreground or background - generated by Vocal Separation). Only the steps the selected type
+        depends on are computed.
 
         Args:
-            spec_type (str): {raw, harmonic, or percussive}. Default: 'raw'.
+            spec_type (str): {raw, harmonic, percussive, foreground or background}. Default: 'harmonic'.
                 Type of spectrogram to use in downstream parsing.
         """
-        spec_selector = {
-            'raw': self.spec_raw,
-            'harmonic': self.spec_harmonic,
-            'percussive': self.spec_percussive,
-            'foreground': self.spec_foreground,
-            'background': self.spec_background,
-        }
-        self.amplitudes = spec_selector[spec_type]
+        if spec_type not in self._spectrogram_parents:
+            raise ValueError(f'Given spec_type argument is not valid: {spec_type}')
+        self.amplitudes = self._resolve_spectrogram(spec_type, self._spectrograms)
+        self._set_time_axis(self.amplitudes.shape[1])
 
         logger.info(f'[DECOMPOSER] >>>> Selected spectrogram type: {spec_type}.')
 
     def _parse_spectrogram(self):
-        """ Parse the spectrogram by iterating through the time axis, thresholding
+        """ Parse the spectrogram by detecting peaks across the whole spectrogram, thresholding
         away quiet frequencies, and mapping the dominant frequencies to piano keys."""
 
-        def _get_peaks_and_threshold(t):
-            """ Given a time(t), extract the dominant frequencies in the amplitude
-            matrix using argrelextrema, and threshold all other values to zero.
-            Store in a new matrix, self.dominant_amplitudes. Thresholding performed by
-            selecting the inverse indices of the detected peaks. Populates class
-            property matrcies.
-
-            Args:
-                t (int): time point to extract note data
-
-            """
-
-            # peak detection in a amplitude vector at time t
-            # take log of vec since amplitudes decay exponentially at higher freqs
-            # https://stackoverflow.com/questions/1713335/peak-finding-algorithm-for-python-scipy/52612432#52612432
-            peaks_idx = find_peaks(np.log(self.amplitudes[:, t]), prominence=3)[0]
-
-            # select inverse indices of peaks, threshold to zero
-            arr = self.dominant_amplitudes[:, t]
-            ia = np.indices(arr.shape)
-            not_indices = np.setxor1d(ia, peaks_idx)
-            arr[not_indices] = 0
-            self.dominant_amplitudes[:, t] = arr
-
-        def _extract_notes_and_populate_chromagram(t):
-            """ Map the dominant frequencies at time(t) to the corresponding piano keys.
-
-            If we detect a frequency in self.dominant_amplitudes, quantize that frequency into
-            one of the piano frequency bins, store in array detected_freqs, and get the piano note
-            index using self._map_freq2note.
-
-            Args:
-                t (int): time point to extract note data
-            Returns
-                np.ndarray or None: array of key numbers active at time (t)
-                np.ndarray or None: array of corresponding ampltidues active at time (t)
-            """
-
-            # if dominant frequency vector is non-zero, map all detected freqs to notes
-            amp_arr = self.dominant_amplitudes[:, t]
-            if np.count_nonzero(amp_arr) != 0:
-                freq_idx_non_zero = np.nonzero(amp_arr)[0]
-                detected_freqs = self.freqs[freq_idx_non_zero]
-
-                # active key numbers and corresponding amplitudes
-                key_number_array = self._map_freq2note(detected_freqs)
-                amp_array_non_zero = amp_arr[freq_idx_non_zero]
-
-                # Note: Chromagram uses raw amplitude values. It has not been normalzied or thresholded!
-                self.chromagram_raw[key_number_array - 1, t] = amp_array_non_zero
-                return key_number_array, amp_array_non_zero
-            return None, None
-
-        # init dom freqs matrix, iterate through time, find peaks and threshold
-        self.dominant_amplitudes = self.amplitudes.copy()
-        for time in tqdm(range(self.t_final)):
-            _get_peaks_and_threshold(time)
+        # the selected spectrogram is not needed past peak picking (unless kept for plotting): pick peaks in place
+        inplace = not self.keep_spectrograms
+        self.dominant_amplitudes = self._find_dominant_amplitudes(self.amplitudes, self.t_final, inplace=inplace)
+        if inplace:
+            self.amplitudes = None
+            self._spectrograms.clear()
         logger.info(f'[DECOMPOSER] >>>> Parsed spectrogram. Found dominant frequencies. MEM {get_memory_usage()}')
 
-        # median filter along time axis to get rid of white noise
-        self.dominant_amplitudes = np.apply_along_axis(self._median_filter, 1, self.dominant_amplitudes)
-
-        # iterate through time, map dominant frequencies to notes
-        self.chromagram_raw = np.zeros((self.last_key_num, self.t_final))
-        for time in tqdm(range(self.t_final)):
-            _extract_notes_and_populate_chromagram(time)
+        self.chromagram_raw = self._map_amplitudes_to_keys(self.dominant_amplitudes[:, :self.t_final])
         self.chromagram = self._normalize_and_threshold_chromagram()
         logger.info(
             f'[DECOMPOSER] >>>> Mapped frequencies to notes and generated chromagram. '
             f'MEM: {get_memory_usage()}'
         )
 
+    def _find_dominant_amplitudes(self, amplitudes, t_final=None, inplace=False):
+        """ Detect the dominant frequencies of every amplitude vector, threshold all other values to zero,
+        and median filter the result along the time axis.
+
+        Args:
+            amplitudes (np.ndarray): spectrogram to parse (frequency x time)
+            t_final (int or None): only detect peaks in the first t_final time points
+            inplace (bool): overwrite amplitudes with the result instead of copying them
+
+        Returns:
+            np.ndarray: dominant amplitudes, same shape as amplitudes
+        """
+
+        # peak detection on every amplitude vector at once, threshold all non-peaks to zero.
+        # take log of spectrogram since amplitudes decay exponentially at higher freqs
+        # https://stackoverflow.com/questions/1713335/peak-finding-algorithm-for-python-scipy/52612432#52612432
+        with self.metrics.stage('peak_picking') as stage:
+            dominant_amplitudes = amplitudes if inplace else amplitudes.copy()
+            with np.errstate(divide='ignore'):
+                log_amplitudes = np.log(amplitudes[:, :t_final])
+            peaks_mask = find_peaks_2d(log_amplitudes, prominence=self.peak_prominence)
+            dominant_amplitudes[:, :t_final][~peaks_mask] = 0
+            del log_amplitudes, peaks_mask
+
+            # median filter along time axis to get rid of white noise
+            dominant_amplitudes = self._median_filter(dominant_amplitudes)
+            stage.record(dominant_amplitudes=dominant_amplitudes)
+        return dominant_amplitudes
+
+    def _map_amplitudes_to_keys(self, dominant_amplitudes):
+        """ Map the dominant frequencies to piano keys. Bins are sorted by key, so each key takes the
+        loudest of its run of bins.
+
+        Args:
+            dominant_amplitudes (np.ndarray): dominant amplitudes (frequency x time)
+
+        Returns:
+            np.ndarray: raw chromagram (key x time). It has not been normalized or thresholded!
+        """
+        with self.metrics.stage('key_mapping') as stage:
+            chromagram_raw = np.zeros((self.last_key_num, dominant_amplitudes.shape[1]), dtype=self.dtype)
+            chromagram_raw[self._key_numbers - 1] = np.maximum.reduceat(
+                dominant_amplitudes, self._key_bin_starts, axis=0
+            )
+            stage.record(chromagram_raw=chromagram_raw)
+        return chromagram_raw
+
+    def _open_stream(self):
+        """ Read the wav file's metadata to set up streaming: number of samples at self.sample_rate,
+        duration and time alignment vector. The audio itself is read block by block in stream_chromagram. """
+        import soundfile as sf
+
+        info = sf.info(self.wav_file)
+        self._native_sample_rate = info.samplerate
+        self._n_native = info.frames
+        if self.stop_time:
+            self._n_native = min(self._n_native, int(round(self.stop_time * info.samplerate)))
+
+        # length of the whole song resampled to self.sample_rate (as librosa.resample would output)
+        self._n_samples = int(np.ceil(self._n_native * self.sample_rate / self._native_sample_rate))
+        self.duration = self._n_samples / self.sample_rate
+        self._set_time_axis(1 + self._n_samples // (self.n_fft // 4))
+
+    def _read_audio(self, sound_file, start, stop):
+        """ Read samples [start, stop) of the song, resampled to self.sample_rate. Samples outside the song
+        are reflected at its edges, matching the padding of librosa.stft(center=True).
+
+        Resampling starts from a native sample that maps exactly onto a resampled sample, with a margin
+        of context on each side, so the block lines up with the resampled song as a whole.
+
+        Args:
+            sound_file (soundfile.SoundFile): open wav file
+            start (int): first sample to read (at self.sample_rate), may be negative
+            stop (int): sample to read until (at self.sample_rate), may exceed the song length
+
+        Returns:
+            np.ndarray: mono audio of length stop - start
+        """
+        step = gcd(self._native_sample_rate, self.sample_rate)
+        step_native, step_resampled = self._native_sample_rate // step, self.sample_rate // step
+        margin = self.sample_rate
+
+        first = max(start - margin, 0) // step_resampled * step_resampled
+        native_first = first // step_resampled * step_native
+        native_last = min(int(np.ceil((stop + margin) * self._native_sample_rate / self.sample_rate)), self._n_native)
+
+        sound_file.seek(native_first)
+        audio = sound_file.read(native_last - native_first, dtype='float32', always_2d=True).mean(axis=1)
+        audio = librosa.resample(audio, orig_sr=self._native_sample_rate, target_sr=self.sample_rate)
+        audio = audio[max(start, 0) - first: min(stop, self._n_samples) - first]
+
+        pad = (max(-start, 0), max(stop - self._n_samples, 0))
+        if any(pad):
+            audio = np.pad(audio, pad, mode='reflect')
+        return audio
+
+    def stream_chromagram(self, spec_type='harmonic'):
+        """ Decompose the song block by block, yielding raw chromagram columns as they are computed.
+        Only a single block of audio and its spectrograms is held in memory at a time.
+
+        Each block is extended by self.stream_halo frames on both sides, so the median filters and HPSS
+        see the same context as on the whole song. Vocal separation only searches for neighbours within
+        the extended block, so foreground/background spectrograms are an approximation.
+
+        Args:
+            spec_type (str): {raw, harmonic, percussive, foreground or background}. Default: 'harmonic'.
+
+        Yields:
+            int: index of the first time point in the block
+            np.ndarray: raw chromagram of the block (key x time)
+        """
+        import soundfile as sf
+
+        hop = self.n_fft // 4
+        n_frames = self.times.shape[0]
+        block_frames = max(int(self.block_duration * self.sample_rate / hop), 1)
+
+        with sf.SoundFile(self.wav_file) as sound_file:
+            for start in range(0, n_frames, block_frames):
+                stop = min(start + block_frames, n_frames)
+                first, last = max(start - self.stream_halo, 0), min(stop + self.stream_halo, n_frames)
+
+                # audio covering exactly the STFT windows of frames [first, last)
+                audio_start, audio_stop = first * hop - self.n_fft // 2, (last - 1) * hop + self.n_fft // 2
+                with self.metrics.stage('load') as stage:
+                    audio = self._read_audio(sound_file, audio_start, audio_stop)
+                    stage.record(audio_ts=audio)
+                spectrograms = {'raw': self._raw_spectrogram(audio, center=False)}
+                amplitudes = self._resolve_spectrogram(spec_type, spectrograms)
+                dominant_amplitudes = self._find_dominant_amplitudes(amplitudes, inplace=not self.keep_spectrograms)
+                yield start, self._map_amplitudes_to_keys(dominant_amplitudes[:, start - first: stop - first])
+
+    def _parse_spectrogram_streaming(self, spec_type='harmonic'):
+        """ Streaming counterpart of _generate_spectrogram, _select_spectrogram & _parse_spectrogram.
+        Only the chromagrams of the whole song are kept. """
+        self.chromagram_raw = np.zeros((self.last_key_num, self.t_final), dtype=self.dtype)
+        for start, chromagram_block in self.stream_chromagram(spec_type):
+            if start >= self.t_final:
+                break
+            chromagram_block = chromagram_block[:, :self.t_final - start]
+            self.chromagram_raw[:, start: start + chromagram_block.shape[1]] = chromagram_block
+            logger.info(
+                f'[DECOMPOSER] >>>> Streamed {start + chromagram_block.shape[1]}/{self.t_final} frames. '
+                f'MEM: {get_memory_usage()}'
+            )
+        self.chromagram = self._normalize_and_threshold_chromagram()
+
     def _normalize_and_threshold_chromagram(self, thresh=None):
         """Normalize and threhold the raw chromagram to [0, 1]
         Args:
@@ -267,10 +709,35 @@ class Decomposer(object):
             np.ndarray: normalized, filtered chromagram  (88 key-y-axis).
 
         """
-        chromagram = self._normalize_filter(self.chromagram_raw, algo=self.norm_algo)
-        chromagram[chromagram < (thresh or self.amp_thresh)] = 0
+        with self.metrics.stage('normalize') as stage:
+            chromagram = self._normalize_filter(self.chromagram_raw, algo=self.norm_algo)
+            chromagram[chromagram < (thresh or self.amp_thresh)] = 0
+            stage.record(chromagram=chromagram)
         return chromagram
 
+    def note_events(self, off_thresh=None, min_frames=2):
+        """ Note events of the song: the consecutive active frames of every key merged into notes, with hysteresis
+        around self.amp_thresh. A compact alternative to the chromagram, see note_events.extract_notes.
+
+        Args:
+            off_thresh (float or None): [0, self.amp_thresh] normalized amplitude a note must stay above to go on.
+                Default: half of self.amp_thresh.
+            min_frames (int): notes shorter than this many frames are dropped
+
+        Returns:
+            list: (key, onset, offset, velocity) notes
+        """
+        with self.metrics.stage('note_events'):
+            # unthresholded, so notes can go on below self.amp_thresh
+            chromagram = self._normalize_filter(self.chromagram_raw, algo=self.norm_algo)
+            notes = extract_notes(
+                chromagram, self.times, on_thresh=self.amp_thresh,
+                off_thresh=self.amp_thresh / 2 if off_thresh is None else off_thresh, min_frames=min_frames,
+                amplitudes=self.chromagram_raw
+            )
+        logger.info(f'[DECOMPOSER] >>>> Extracted {len(notes)} note events. MEM: {get_memory_usage()}')
+        return notes
+
     def _plot_spectrogram(self, spectrogram, title='', scaler='db', **kwargs):
         """ Plot spectrograms for debugging.
 
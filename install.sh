@@ -2,7 +2,7 @@
 
 # Install dependencies, source code
 sudo apt-get update
-sudo apt-get install -y ffmpeg nodejs npm python3-pip git
+sudo apt-get install -y ffmpeg libportaudio2 nodejs npm python3-pip git
 git clone https://github.com/momonala/aposynthese.git
 cd aposynthese
 sudo npm install
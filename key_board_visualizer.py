@@ -1,14 +1,31 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import logging
+import multiprocessing
 import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import islice
 
 import numpy as np
 from PIL import Image, ImageDraw
 
+from signal_process_utils import key_geometry
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# visualizer of the render pool's worker processes, inherited when they are forked. See KeyBoardVisualizer.iter_frames
+_render_visualizer = None
+
+
+def _render_chunk(time_points):
+    """ Render a chunk of keyboard frames in a render pool worker. """
+    return [_render_visualizer._render_time_point(t) for t in time_points]
+
 
 class KeyBoardVisualizer(object):
     def __init__(self, decomposer, scale=2):
@@ -16,12 +33,19 @@ class KeyBoardVisualizer(object):
         and map that to piano keys.
 
         Args:
-            decomposer (decomposer.Decomposer): with already precomputed self.chromagram
+            decomposer (decomposer.Decomposer): with already precomputed self.chromagram (normalized once for the
+                whole song, frames only look up their column). Rasterizing, rendering
+                and encoding are recorded into its metrics (except frames rendered by a render pool's workers).
             scale (int): factor to resize origin image (from 1920x1080 resolution)
         """
 
         self.decomposer = decomposer
+        self.metrics = decomposer.metrics
         self.fps_out = 30  # fps of output video
+        self.filter_delay = 4  # frames the chromagram lags the audio by (Decomposer's 2 trailing median filters)
+        self.loudness_levels = 64  # opacity levels of a key (max 256), fewer levels make more frames identical
+        self.frame_cache_size = 64  # max number of rendered frames memoized by keyboard state
+        self._frame_cache = OrderedDict()
 
         # init a fresh piano img (use HSV if not using addWeighted func in _generate_keyboard, else RGB)
         piano_img = os.path.join('assets', 'piano.jpg')
@@ -37,6 +61,81 @@ class KeyBoardVisualizer(object):
         self.keyboard_width = self.piano_template.size[1]  # size of keyboard in video
         self.width_full = self.length_full * 9 // 16  # expected width of a full frame (16:9 aspect ratio)
 
+        # frames are composited in numpy, over the RGB template and each key's rasterized polygon
+        self.fill_color = np.array([0, 255, 0], dtype=np.int32)
+        self.outline_color = np.array([0, 255, 240], dtype=np.int32)
+        self.piano_rgb = np.array(self.piano_template.convert('RGB'))
+        with self.metrics.stage('rasterize'):
+            self.key_sprites = self._rasterize_keys()
+
+        # chromagram time point shown by every video frame
+        self.frame_time_points = self._resample_time_points()
+
+    def _resample_time_points(self):
+        """ Resample the chromagram's time axis to self.fps_out: every video frame shows the time point nearest
+        to it, once the filter delay is compensated for. The STFT hop rate is unrelated to the video frame rate,
+        so time points are repeated or skipped.
+
+        Returns:
+            np.ndarray: index of the chromagram time point of every video frame
+        """
+        n_time_points = self.decomposer.chromagram_raw.shape[1]
+        times = self.decomposer.times[:n_time_points]
+        delay = times[min(self.filter_delay, n_time_points - 1)] - times[0]
+        frame_times = np.arange(int(times[-1] * self.fps_out) + 1) / self.fps_out
+        return np.rint(np.interp(frame_times + delay, times, np.arange(n_time_points))).astype(int)
+
+    def _rasterize_keys(self):
+        """ Rasterize the polygon of every key once, cropped to its bounding box on the keyboard image.
+
+        Returns:
+            list: sprite of every chromagram row, None for rows without a key polygon. A sprite is a dict of
+                the bounding box (rows, cols slices), the fill and outline pixel masks (int32 0/1, outline
+                pixels are not fill pixels), the RGB color of every pixel and the column range of the key in
+                the piano roll (roll).
+        """
+        # the keys have always been drawn with the full resolution geometry, whatever the scale of the image
+        geometry = key_geometry()
+        sprites = []
+        for key_number in range(self.decomposer.chromagram_raw.shape[0]):
+            idx = 89 - key_number
+            row = self.decomposer.last_key_num - 1 - idx
+            polygon = geometry['polygons'][row]
+
+            # same polygon as drawn by ImageDraw onto a full frame, fill and outline told apart by value
+            poly = Image.new('L', (self.length_full, self.keyboard_width))
+            ImageDraw.Draw(poly).polygon(polygon.ravel().tolist(), fill=1, outline=2)
+            bbox = poly.getbbox()
+            if bbox is None:
+                sprites.append(None)  # key lies outside of the keyboard image
+                continue
+            sprite = np.array(poly.crop(bbox), dtype=np.int32)
+            fill, outline = (sprite == 1).astype(np.int32), (sprite == 2).astype(np.int32)
+            sprites.append({
+                'rows': slice(bbox[1], bbox[3]),
+                'cols': slice(bbox[0], bbox[2]),
+                'fill': fill,
+                'outline': outline,
+                'color': fill[..., None] * self.fill_color + outline[..., None] * self.outline_color,
+                'roll': tuple(geometry['x_extents'][row].tolist()),
+            })
+        return sprites
+
+    def _blend_key(self, frame, sprite, alpha):
+        """ Alpha blend a key onto a frame in place, only over the key's bounding box. Matches PIL's
+        Image.paste(poly, mask=poly) to the pixel: out = (dst * (255 - m) + src * m) / 255, rounded the way
+        PIL does, with m = alpha over the fill and 255 over the outline.
+
+        Args:
+            frame (np.ndarray): RGB frame (uint8)
+            sprite (dict): see self._rasterize_keys
+            alpha (int): [0, 255] opacity of the fill
+        """
+        region = frame[sprite['rows'], sprite['cols']]
+        mask = (sprite['fill'] * alpha + sprite['outline'] * 255)[..., None]
+        blended = region * (255 - mask) + sprite['color'] * mask + 128
+        region[...] = (blended + (blended >> 8)) >> 8
+
     def _generate_keyboard(self, t):
         """ Iterate through notes found in sample and draw on keyboard image.
         Intensity of color depends on loudness (decibels).
@@ -48,51 +147,241 @@ class KeyBoardVisualizer(object):
             Tuple(np.ndarray, np.ndarray): image of colorized piano, piano roll slice
 
         """
-        piano_out = self.piano_template.copy()
+        return self._render_keys(*self._keyboard_state(t))
+
+    def _keyboard_state(self, t):
+        """ Keys to color at a time point, and their opacity. Two time points with the same state have the same
+        keyboard frame. Opacities are quantized to self.loudness_levels levels.
+
+        Args:
+            t (int): time point of the chromagram
+        Returns:
+            Tuple(np.ndarray, np.ndarray): key numbers (chromagram rows), opacities in [0, 255]
+        """
+        loudness = self.decomposer.chromagram[:, t]
+
+        # only notes above the loudness thresh are colored
+        key_numbers = np.nonzero(loudness > self.decomposer.amp_thresh)[0]
+        alphas = (255 * loudness[key_numbers]).astype(np.int64)
+        alphas -= alphas % (256 // self.loudness_levels)
+        return key_numbers, alphas
+
+    def _render_keys(self, key_numbers, alphas):
+        """ Draw keys onto the keyboard image, all stacked into a single image.
+
+        Args:
+            key_numbers (np.ndarray): keys to color (chromagram rows)
+            alphas (np.ndarray): opacity of each key, in [0, 255]
+        Returns:
+            Tuple(np.ndarray, np.ndarray): image of colorized piano, piano roll slice
+        """
+        piano_out = self.piano_rgb.copy()
         piano_roll_slice = np.zeros((1, self.length_full, 3), dtype=np.uint8)
+        for key_number, alpha in zip(key_numbers, alphas):
+            sprite = self.key_sprites[key_number]
+            if sprite is None:
+                continue
 
-        key_number_array = np.nonzero(self.decomposer.chromagram_raw[:, t])[0]
-        amp_array_non_zero = self.decomposer.chromagram_raw[key_number_array, t]
-        if key_number_array.size > 0:
-            amp_array_non_zero = self.decomposer._normalize_filter(amp_array_non_zero, algo=self.decomposer.norm_algo)
+            # fill in time vector for piano roll
+            piano_roll_slice[:, sprite['roll'][0]: sprite['roll'][1], 1] = alpha
 
-            # iterate through detected notes, extract location on keyboard if loudness thresh met
-            for n in range(key_number_array.shape[0]):
-                idx = 89 - key_number_array[n]
-                loudness = amp_array_non_zero[n]
+            # color in detected note on keyboard img, stacked onto output img
+            self._blend_key(piano_out, sprite, alpha)
+        return piano_out, piano_roll_slice
 
-                if loudness > self.decomposer.amp_thresh:
-                    piano_loc_points = self.decomposer.freq_table.iat[self.decomposer.last_key_num - 1 - idx, -1]
-                    if type(piano_loc_points) is not list:
-                        continue  # handle nan case
+    def _render_time_point(self, t):
+        """ Keyboard image of a time point, memoized by keyboard state: runs of identical states (e.g. sustained
+        notes, or time points repeated by the resampling to self.fps_out) are rendered once. The
+        self.frame_cache_size most recently used frames are kept.
 
-                    # fill in time vector for piano roll
-                    piano_roll_slice[:, piano_loc_points[0][0]: piano_loc_points[-1][0], 1] = int(255 * loudness)
+        Args:
+            t (int): time point of the chromagram
+        Returns:
+            np.ndarray: image of colorized piano. Shared between identical frames, must not be modified.
+        """
+        key_numbers, alphas = self._keyboard_state(t)
+        state = key_numbers.tobytes() + alphas.tobytes()
+        frame = self._frame_cache.pop(state, None)
+        if frame is None:
+            with self.metrics.stage('render') as stage:
+                frame = self._render_keys(key_numbers, alphas)[0]
+                stage.record(frame=frame)
+        self._frame_cache[state] = frame
+        while len(self._frame_cache) > self.frame_cache_size:
+            self._frame_cache.popitem(last=False)
+        return frame
+
+    def iter_frames(self, start=0, workers=None, chunk_size=32):
+        """ Generate the video frames in order, from a frame onwards. See self.frame_time_points.
+
+        With workers, chunks of frames are rendered by a pool of forked processes. At most 2 chunks per worker
+        are in flight, so memory stays bounded when the consumer (the encoder) is slower than the pool.
+
+        Args:
+            start (int): first video frame
+            workers (int or None): number of render processes, None renders in this process
+            chunk_size (int): number of frames per task of the render pool
+        Yields:
+            np.ndarray: RGB image of the colorized piano
+        """
+        global _render_visualizer
+
+        time_points = self.frame_time_points
+        if not workers or workers < 2:
+            for t in time_points[start:]:
+                yield self._render_time_point(t)
+            return
+
+        _render_visualizer = self
+        chunks = (time_points[c: c + chunk_size] for c in range(start, time_points.shape[0], chunk_size))
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            pending = deque(pool.apply_async(_render_chunk, (chunk,)) for chunk in islice(chunks, 2 * workers))
+            while pending:
+                frames = pending.popleft().get()
+                for chunk in islice(chunks, 1):
+                    pending.append(pool.apply_async(_render_chunk, (chunk,)))
+                yield from frames
+
+    def _make_frame(self, workers=None):
+        """ Frame function of a moviepy VideoClip at self.fps_out.
+        Frames are pulled from self.iter_frames as the encoder asks for them, so only the current frame (and the
+        frame cache) is held in memory. A frame asked for twice is not rendered again.
+
+        Args:
+            workers (int or None): see self.iter_frames
+        Returns:
+            callable: time (s) -> RGB image
+        """
+        n_frames = self.frame_time_points.shape[0]
+        eps = float(np.finfo(np.float32).eps)  # guard against time * fps rounding down below a frame
+        state = {'frames': None, 't': None, 'frame': None}
 
-                    # color in detected note on keyboard img, stack onto output img
-                    poly = Image.new('RGBA', (self.length_full, self.keyboard_width))
-                    pdraw = ImageDraw.Draw(poly)
-                    pdraw.polygon(piano_loc_points, fill=(0, 255, 0, int(255 * loudness)), outline=(0, 255, 240, 255))
-                    piano_out.paste(poly, mask=poly)
-        return np.array(piano_out.convert('RGB')), piano_roll_slice
+        def make_frame(time):
+            t = min(int((time + eps) * self.fps_out), n_frames - 1)
+            if state['frames'] is None:
+                state['frames'], state['t'] = self.iter_frames(start=t, workers=workers), t - 1
+            elif t < state['t']:
+                # random access behind the stream, e.g. probing frame 0
+                return self._render_time_point(self.frame_time_points[t])
+            while state['t'] < t:
+                state['frame'], state['t'] = next(state['frames']), state['t'] + 1
+            return state['frame']
 
-    def build_movie(self):
-        """ Concatenate self._full_frames images into video file, add back original music. """
-        from moviepy.editor import AudioFileClip, ImageSequenceClip
+        return make_frame
 
-        outname = self.decomposer.wav_file.replace('input', 'output')
-        outname = outname.replace('wav', 'mp4')
+    def build_movie(self, outname=None, workers=None):
+        """ Stream the keyboard frames into a video file, add back original music.
 
-        output = ImageSequenceClip(
-            [self._generate_keyboard(t)[0] for t in range(self.decomposer.chromagram_raw.shape[1])], fps=self.fps_out/2
+        Args:
+            outname (str or None): path of the output video. Default: the audio file's path, in output/ as mp4.
+            workers (int or None): number of processes rendering frames, see self.iter_frames
+        """
+        from moviepy.editor import AudioFileClip, VideoClip
+
+        if outname is None:
+            outname = os.path.splitext(self.decomposer.wav_file.replace('input', 'output'))[0] + '.mp4'
+
+        output = VideoClip(
+            self._make_frame(workers=workers), duration=self.frame_time_points.shape[0] / self.fps_out
         )
-        output = output.cutout(0, 1)  # trim to compensate for FFT lag
         output = output.set_audio(AudioFileClip(self.decomposer.wav_file))
-        output.write_videofile(
-            outname,
-            fps=self.fps_out,
-            temp_audiofile="temp-audio.m4a",
-            remove_temp=True,
-            codec="libx264",
-            audio_codec="aac"
-        )
\ No newline at end of file
+        # includes rendering the frames the encoder pulls, see the 'render' stage
+        with self.metrics.stage('encode'):
+            output.write_videofile(
+                outname,
+                fps=self.fps_out,
+                temp_audiofile=outname.replace('.mp4', '-temp-audio.m4a'),  # unique per video, for parallel jobs
+                remove_temp=True,
+                codec="libx264",
+                audio_codec="aac"
+            )
+
+    def build_stream(self, stream_dir, segment_duration=2, workers=None, on_segment=None):
+        """ Stream the keyboard frames into an HLS playlist of fixed length fragmented MP4 segments, with the
+        original music. Frames are piped to ffmpeg as they are rendered, and ffmpeg appends every segment to the
+        playlist (stream_dir/index.m3u8) as soon as it is complete, so the video can be played while it is being
+        rendered.
+        The playlist is an EVENT playlist: players start from its beginning, and it is closed (#EXT-X-ENDLIST) once
+        the last segment is written.
+
+        Args:
+            stream_dir (str): directory of the playlist and its segments, replaced if it exists
+            segment_duration (float): duration (s) of the segments. Every segment starts with a key frame.
+            workers (int or None): number of processes rendering frames, see self.iter_frames
+            on_segment (callable or None): called with the number of segments in the playlist whenever it grows
+        Returns:
+            str: path of the playlist
+        """
+        # a player must not pick up the complete playlist of a previous render
+        shutil.rmtree(stream_dir, ignore_errors=True)
+        os.makedirs(stream_dir)
+        playlist = os.path.join(stream_dir, 'index.m3u8')
+        height, width = self.piano_rgb.shape[:2]
+        command = [
+            'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(self.fps_out), '-i', '-',
+            '-i', self.decomposer.wav_file,
+            '-map', '0:v', '-map', '1:a', '-t', str(self.frame_time_points.shape[0] / self.fps_out),
+            '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-force_key_frames', f'expr:gte(t,n_forced*{segment_duration})',
+            '-c:a', 'aac',
+            '-f', 'hls', '-hls_time', str(segment_duration), '-hls_playlist_type', 'event', '-hls_list_size', '0',
+            '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+            '-hls_segment_filename', os.path.join(stream_dir, 'segment_%05d.m4s'), playlist
+        ]
+
+        # includes rendering the frames fed to ffmpeg, see the 'render' stage
+        with self.metrics.stage('encode'):
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+            watcher = threading.Thread(target=self._watch_playlist, args=(playlist, process, on_segment), daemon=True)
+            watcher.start()
+            try:
+                for frame in self.iter_frames(workers=workers):
+                    process.stdin.write(frame.tobytes())
+                process.stdin.close()
+            except BrokenPipeError:
+                pass  # ffmpeg failed, see its error below
+            except BaseException:
+                process.kill()
+                raise
+            error = process.stderr.read().decode(errors='replace').strip()
+            process.wait()
+            watcher.join()
+        if process.returncode:
+            raise OSError(f'ffmpeg failed to stream {self.decomposer.wav_file}: {error}')
+        return playlist
+
+    @staticmethod
+    def _watch_playlist(playlist, process, on_segment, interval=0.05):
+        """ Poll a playlist ffmpeg is writing until ffmpeg exits, calling on_segment(n_segments) whenever it grows.
+        ffmpeg replaces the playlist atomically, so it is never read half written. """
+        n_segments = 0
+        while True:
+            done = process.poll() is not None
+            try:
+                with open(playlist) as f:
+                    count = f.read().count('#EXTINF')
+            except FileNotFoundError:
+                count = 0
+            if count > n_segments:
+                n_segments = count
+                if on_segment is not None:
+                    on_segment(n_segments)
+            if done:
+                return
+            time.sleep(interval)
+
+    @staticmethod
+    def remux_stream(playlist, outname):
+        """ Join the segments of a complete HLS playlist into a single mp4 video, without re-encoding.
+
+        Args:
+            playlist (str): path of the playlist, see self.build_stream
+            outname (str): path of the output video
+        """
+        command = [
+            'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', '-i', playlist,
+            '-c', 'copy', '-movflags', '+faststart', '-f', 'mp4', outname
+        ]
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode:
+            raise OSError(f'ffmpeg failed to remux {playlist}: {process.stderr.decode(errors="replace").strip()}')
\ No newline at end of file
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import sys
+import time
+
+import numpy as np
+from scipy.ndimage import median_filter
+
+from chromagram_cache import pin_numba_cache
+from signal_process_utils import find_peaks_2d, key_filterbank, key_geometry, map_frequencies_to_keys
+
+# the numba cache must be pinned before the decomposer imports librosa
+pin_numba_cache()
+from decomposer import Decomposer  # noqa: E402
+
+# logger with special stream handling to output to stdout in Node.js
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+stdout_handler.setLevel(logging.INFO)
+# logger.addHandler(stdout_handler)
+
+# numpy dtype of the raw PCM sample formats (ffmpeg names), and the scale of their samples
+PCM_FORMATS = {'s16le': (np.dtype('<i2'), 1 / 32768), 'f32le': (np.dtype('<f4'), 1)}
+
+
+class LiveDecomposer(object):
+    def __init__(
+        self, sample_rate=8372, n_fft=2048, hop_length=None, spec_type='harmonic', front_end='stft',
+        harmonic_frames=5, amp_thresh=0.3
+    ):
+        """ Incremental counterpart of Decomposer for live audio: blocks of samples go in as they are recorded,
+        active piano keys come out once per hop. Every stage only looks at past frames:
+        - STFT of the last n_fft samples, once per hop_length new samples.
+        - median filter of every bin over its last 5 frames (the Decomposer's median filter is causal already).
+        - HPSS approximation: the harmonic part is the median of a bin over its last harmonic_frames frames
+          (instead of a centered window), the percussive part the median over frequency of the current frame.
+        - peak picking, median filter, key mapping and normalization as in the Decomposer, frame by frame.
+        Vocal separation and the CQT front end need the whole song, they are not available.
+
+        A note shows up about harmonic_frames / 2 hops after its onset, once it dominates the harmonic median.
+
+        Args:
+            sample_rate (int): sample rate of the audio
+            n_fft (int): FFT window size
+            hop_length (int or None): number of samples between frames. Default: n_fft // 4
+            spec_type (str): {raw, harmonic or percussive}. Default: 'harmonic'. Spectrogram to pick peaks in.
+            front_end (str): {stft or filterbank}, see Decomposer
+            harmonic_frames (int): length of the harmonic median filter (frames)
+            amp_thresh (float): [0, 1] threshold of normalized amplitudes, see Decomposer.amp_thresh
+        """
+        if spec_type not in ('raw', 'harmonic', 'percussive'):
+            raise ValueError(f'Given spec_type argument is not valid in live mode: {spec_type}')
+        if front_end not in ('stft', 'filterbank'):
+            raise ValueError(f'Given front_end argument is not valid in live mode: {front_end}')
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop_length = hop_length or n_fft // 4
+        self.spec_type = spec_type
+        self.front_end = front_end
+        self.amp_thresh = amp_thresh
+        self.last_key_num = 89
+        self.norm_algo = 'div_max'
+        self.peak_prominence = 3 if front_end == 'stft' else 0.5  # see Decomposer.peak_prominence
+        self.hpss_margin = 2
+        self.percussive_bins = 31
+        self.dtype = np.float32
+
+        # periodic Hann window, as librosa.stft
+        self._window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)).astype(self.dtype)
+        freqs = np.fft.rfftfreq(n_fft, d=1 / sample_rate)
+        key_frequencies = key_geometry()['frequencies']
+        if front_end == 'stft':
+            bin2key = self.last_key_num - map_frequencies_to_keys(freqs, key_frequencies)
+        else:
+            bin2key = self.last_key_num - np.arange(key_frequencies.size)[::-1]
+            self._filterbank = key_filterbank(freqs, key_frequencies[::-1])
+        self._key_numbers, self._key_bin_starts = np.unique(bin2key, return_index=True)
+        n_bins = bin2key.size
+
+        self._audio = np.zeros(n_fft, dtype=self.dtype)  # last n_fft samples
+        self._pending = np.zeros(0, dtype=self.dtype)  # samples received since the last frame
+        # ring buffers of the last frames, see self._push
+        self._raw_frames = np.zeros((n_bins, 5), dtype=self.dtype)
+        self._filtered_frames = np.zeros((n_bins, harmonic_frames), dtype=self.dtype)
+        self._dominant_frames = np.zeros((n_bins, 5), dtype=self.dtype)
+        self.n_frames = 0
+        self._process_frame()  # warm up (lazy imports) on silence, which leaves the ring buffers as they are
+        self.latencies = []  # seconds from receiving the samples that complete a frame to its keys, per frame
+
+    def process(self, samples):
+        """ Feed a block of samples (of any length), and get the keys of every frame it completes.
+
+        Args:
+            samples (np.ndarray): mono audio
+        Yields:
+            int: index of the frame
+            float: time (s) of the last sample of the frame
+            list: key numbers of the active keys
+        """
+        received = time.perf_counter()
+        self._pending = np.concatenate((self._pending, samples.astype(self.dtype, copy=False)))
+        hop = self.hop_length
+        while self._pending.size >= hop:
+            self._audio[:-hop] = self._audio[hop:]
+            self._audio[-hop:] = self._pending[:hop]
+            self._pending = self._pending[hop:]
+            keys = self._process_frame()
+            self.latencies.append(time.perf_counter() - received)
+            self.n_frames += 1
+            yield self.n_frames - 1, self.n_frames * hop / self.sample_rate, keys
+
+    def _push(self, frames, frame):
+        """ Write a frame into a ring buffer of frames, and return the median of the buffer along time. The
+        order of the frames does not matter to the median, so the oldest frame is simply overwritten. """
+        frames[:, self.n_frames % frames.shape[1]] = frame
+        return np.median(frames, axis=1)
+
+    def _process_frame(self):
+        """ Active keys of the frame ending with the last received sample. """
+        spectrum = np.abs(np.fft.rfft(self._audio * self._window)).astype(self.dtype)
+        if self.front_end == 'filterbank':
+            spectrum = self._filterbank @ spectrum
+        spectrum = self._push(self._raw_frames, spectrum)
+
+        if self.spec_type != 'raw':
+            harmonic = self._push(self._filtered_frames, spectrum)
+            percussive = median_filter(spectrum, size=self.percussive_bins, mode='reflect')
+            if self.spec_type == 'harmonic':
+                x, x_ref = harmonic, percussive
+            else:
+                x, x_ref = percussive, harmonic
+            spectrum = Decomposer._apply_softmask(spectrum, x, x_ref * self.hpss_margin, 2)
+
+        with np.errstate(divide='ignore'):
+            peaks = find_peaks_2d(np.log(spectrum)[:, np.newaxis], prominence=self.peak_prominence)[:, 0]
+        dominant = self._push(self._dominant_frames, np.where(peaks, spectrum, 0))
+
+        chromagram = np.zeros((self.last_key_num, 1), dtype=self.dtype)
+        chromagram[self._key_numbers - 1, 0] = np.maximum.reduceat(dominant, self._key_bin_starts)
+        chromagram = Decomposer._normalize_filter(chromagram, algo=self.norm_algo)
+        return np.nonzero(chromagram[:, 0] > self.amp_thresh)[0].tolist()
+
+    def latency_report(self):
+        """ Percentiles of the per frame latencies (ms), see self.latencies. The analysis window and the hop add
+        to them: a frame covers the last n_fft samples, and is only complete once hop_length new samples arrived.
+
+        Returns:
+            dict: report
+        """
+        latencies = np.array(self.latencies or [0]) * 1e3
+        return {
+            'frames': self.n_frames,
+            'hop_ms': round(self.hop_length / self.sample_rate * 1e3, 2),
+            'window_ms': round(self.n_fft / self.sample_rate * 1e3, 2),
+            **{f'p{q}_ms': round(float(np.percentile(latencies, q)), 3) for q in (50, 90, 99)},
+            'max_ms': round(float(latencies.max()), 3),
+        }
+
+
+def read_pcm(stream, block_size, sample_format='s16le'):
+    """ Read raw mono PCM (e.g. from stdin or a named pipe) block by block, until the end of the stream.
+
+    Args:
+        stream (file): binary stream
+        block_size (int): number of samples per block
+        sample_format (str): {s16le or f32le}, see PCM_FORMATS
+    Yields:
+        np.ndarray: block of samples (float32). The last one may be shorter.
+    """
+    dtype, scale = PCM_FORMATS[sample_format]
+    n_bytes = block_size * dtype.itemsize
+    pending = b''
+    while True:
+        chunk = stream.read(n_bytes - len(pending))
+        if not chunk:
+            break
+        pending += chunk
+        if len(pending) == n_bytes:
+            yield np.frombuffer(pending, dtype=dtype).astype(np.float32) * scale
+            pending = b''
+    usable = len(pending) - len(pending) % dtype.itemsize
+    if usable:
+        yield np.frombuffer(pending[:usable], dtype=dtype).astype(np.float32) * scale
+
+
+def read_device(sample_rate, block_size, device=None):
+    """ Record from a sound device (see sounddevice.query_devices) until interrupted.
+
+    Yields:
+        np.ndarray: block of block_size samples (float32, mono)
+    """
+    try:
+        import sounddevice as sd
+    except (ImportError, OSError) as e:  # OSError: sounddevice is installed, but not the PortAudio library
+        raise ImportError(
+            f'Recording from a sound device requires sounddevice and PortAudio ({e}): pip install sounddevice, '
+            'and e.g. apt-get install libportaudio2'
+        ) from e
+
+    with sd.InputStream(
+        samplerate=sample_rate, blocksize=block_size, device=device, channels=1, dtype='float32'
+    ) as stream:
+        while True:
+            block, overflowed = stream.read(block_size)
+            if overflowed:
+                logger.warning('[LIVE] >>>> Input overflow: samples were dropped.')
+            yield block[:, 0]
+
+
+def run(live_decomposer, blocks, out=sys.stdout):
+    """ Decompose blocks of audio as they come, writing the active keys of every frame as a JSON line to out.
+
+    Returns:
+        dict: latency report, see LiveDecomposer.latency_report
+    """
+    try:
+        for block in blocks:
+            for frame, frame_time, keys in live_decomposer.process(block):
+                out.write(json.dumps({'frame': frame, 'time': round(frame_time, 4), 'keys': keys}) + '\n')
+                out.flush()
+    except KeyboardInterrupt:
+        pass
+    report = live_decomposer.latency_report()
+    logger.info(f'[LIVE] >>>> Latency: {json.dumps(report)}')
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', default='-', type=str, help='raw PCM file or pipe, - for stdin')
+    parser.add_argument('-d', '--device', default=None, type=str, help='record from a sound device instead')
+    parser.add_argument('--format', default='s16le', choices=sorted(PCM_FORMATS))
+    parser.add_argument('-r', '--sample_rate', default=8372, type=int)
+    parser.add_argument('--hop_length', default=None, type=int)
+    parser.add_argument('--spec_type', default='harmonic', choices=['raw', 'harmonic', 'percussive'])
+    parser.add_argument('-f', '--front_end', default='stft', choices=['stft', 'filterbank'])
+    parser.add_argument('-a', '--amp_thresh', default=0.3, type=float)
+    args = parser.parse_args()
+
+    live = LiveDecomposer(
+        sample_rate=args.sample_rate, hop_length=args.hop_length, spec_type=args.spec_type,
+        front_end=args.front_end, amp_thresh=args.amp_thresh
+    )
+    logger.info(f'[LIVE] >>>> Listening: {args.device or args.input} at {args.sample_rate}Hz.')
+    if args.device is not None:
+        device = int(args.device) if args.device.isdigit() else args.device
+        run(live, read_device(args.sample_rate, live.hop_length, device=device))
+    elif args.input == '-':
+        run(live, read_pcm(sys.stdin.buffer, live.hop_length, args.format))
+    else:
+        with open(args.input, 'rb') as stream:
+            run(live, read_pcm(stream, live.hop_length, args.format))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import logging
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# logger with special stream handling to output to stdout in Node.js
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+stdout_handler.setLevel(logging.INFO)
+# logger.addHandler(stdout_handler)
+
+# extensions of the media files picked up from input dirs
+MEDIA_EXTENSIONS = ('.flac', '.wav', '.mp3', '.m4a', '.ogg', '.opus', '.webm', '.mp4', '.mkv')
+
+
+def _run_ffmpeg(args, media_file):
+    """ Run ffmpeg, quietly.
+
+    Args:
+        args (list): ffmpeg arguments, after the input file
+        media_file (str): input file
+    Returns:
+        bytes: stdout of ffmpeg
+    Raises:
+        OSError: if ffmpeg is not installed, or fails to read media_file
+    """
+    command = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', '-i', media_file] + args
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise OSError(f'ffmpeg failed on {media_file}: {process.stderr.decode(errors="replace").strip()}')
+    return process.stdout
+
+
+def ingest_media(media_file, outname):
+    """ Extract the audio of any media file ffmpeg can read (video, compressed audio, wav...) into a FLAC file.
+    FLAC is lossless, so this is the only encoding of the audio before the final video is muxed, and soundfile
+    can read it block by block (see Decomposer's streaming mode). The native sample rate is kept.
+
+    Args:
+        media_file (str): path of the media file
+        outname (str): path of the FLAC file
+    Returns:
+        str: outname
+    """
+    start = time.time()
+    _run_ffmpeg(['-vn', '-map', '0:a:0', '-c:a', 'flac', outname], media_file)
+    logger.info(f'[INGEST] >>>> Extracted lossless audio of {media_file} to {outname} in {time.time() - start:.2f}s.')
+    return outname
+
+
+def decode_audio(media_file, sample_rate, duration=None):
+    """ Decode a media file straight to a mono float32 time series at a given sample rate, in a single ffmpeg
+    pass piped into a numpy buffer (no intermediate files).
+
+    Args:
+        media_file (str): path of the media file
+        sample_rate (int): sample rate to resample to
+        duration (float or None): only decode the first duration seconds
+    Returns:
+        np.ndarray: audio time series (read-only, backed by ffmpeg's output)
+    """
+    start = time.time()
+    args = ['-t', str(duration)] if duration else []
+    args += ['-vn', '-map', '0:a:0', '-ac', '1', '-ar', str(sample_rate), '-f', 'f32le', 'pipe:1']
+    audio_ts = np.frombuffer(_run_ffmpeg(args, media_file), dtype=np.float32)
+    logger.info(
+        f'[INGEST] >>>> Decoded {audio_ts.shape[0] / sample_rate:.2f}s of {media_file} at {sample_rate}Hz '
+        f'in {time.time() - start:.2f}s.'
+    )
+    return audio_ts
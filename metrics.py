@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# logger with special stream handling to output to stdout in Node.js
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+stdout_handler.setLevel(logging.INFO)
+# logger.addHandler(stdout_handler)
+
+# Prometheus metric name, help text and stage record field of every exported metric
+PROMETHEUS_METRICS = (
+    ('aposynthese_stage_wall_seconds', 'Wall time of a pipeline stage.', 'wall_s'),
+    ('aposynthese_stage_cpu_seconds', 'CPU time (user + system) of a pipeline stage.', 'cpu_s'),
+    ('aposynthese_stage_peak_rss_delta_megabytes', 'Increase of the peak RSS during a pipeline stage.',
+     'peak_rss_delta_mb'),
+    ('aposynthese_stage_calls', 'Number of times a pipeline stage ran (e.g. once per streamed block).', 'calls'),
+)
+
+
+class Stage(object):
+    def __init__(self, name):
+        """ Metrics of a pipeline stage, accumulated over all its calls (e.g. once per streamed block).
+
+        Args:
+            name (str): name of the stage
+        """
+        self.name = name
+        self.calls = 0
+        self.wall_s = 0.
+        self.cpu_s = 0.
+        self.peak_rss_delta_mb = 0.
+        self.arrays = {}
+
+    def record(self, **arrays):
+        """ Record the shape, dtype and size of arrays the stage produced (e.g. stage.record(spec_raw=spec_raw)). """
+        for name, array in arrays.items():
+            self.arrays[name] = {
+                'shape': list(array.shape), 'dtype': str(array.dtype), 'mb': round(array.nbytes / 1e6, 2)
+            }
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            'calls': self.calls,
+            'wall_s': round(self.wall_s, 4),
+            'cpu_s': round(self.cpu_s, 4),
+            'peak_rss_delta_mb': round(self.peak_rss_delta_mb, 2),
+            'arrays': self.arrays,
+        }
+
+
+class JobMetrics(object):
+    def __init__(self, job=None, path=None, profile_stage=None, profiler='cprofile', profile_dir='output'):
+        """ Per-job metrics of the pipeline stages: wall time, CPU time, increase of the peak RSS and the arrays
+        each stage produced. Stages may nest, e.g. encoding includes the frame rendering it drives.
+
+        Args:
+            job (str): name of the job (e.g. song name), labels every exported metric
+            path (str or None): file to export to (see self.export). Prometheus text format if it ends with
+                '.prom' (e.g. for node_exporter's textfile collector), else JSON lines, one per stage, appended.
+            profile_stage (str or None): name of a stage to profile
+            profiler (str): {cprofile or pyinstrument}. A single profile of all the calls of the stage is dumped
+                by self.export: cProfile stats to {profile_dir}/{job}-{stage}.prof (e.g. for snakeviz), or a
+                pyinstrument report to {profile_dir}/{job}-{stage}.html.
+            profile_dir (str): directory of the profiles
+        """
+        self.job = job
+        self.path = path
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.stages = {}  # stage name -> Stage, in order of first call
+        self._profiler = None  # accumulates every call of the profiled stage, dumped by self.export
+
+    @contextmanager
+    def stage(self, name):
+        """ Measure a stage of the pipeline. Profiled if it is self.profile_stage.
+        The overhead is a few microseconds, so per frame stages can be measured too.
+
+        Args:
+            name (str): name of the stage
+        Yields:
+            Stage: metrics of the stage, see Stage.record
+        """
+        stage = self.stages.setdefault(name, Stage(name))
+        profiler = self._start_profiler() if name == self.profile_stage else None
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        cpu_time = time.process_time()
+        wall_time = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.wall_s += time.perf_counter() - wall_time
+            stage.cpu_s += time.process_time() - cpu_time
+            # ru_maxrss is in KB on Linux
+            stage.peak_rss_delta_mb += (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_rss) / 1e3
+            stage.calls += 1
+            if profiler is not None:
+                self._stop_profiler(profiler)
+
+    def record_wall(self, name, wall_s):
+        """ Record the wall time of a stage that is not a block of code, e.g. from the start of the job to an event.
+
+        Args:
+            name (str): name of the stage
+            wall_s (float): wall time (s)
+        """
+        stage = self.stages.setdefault(name, Stage(name))
+        stage.wall_s += wall_s
+        stage.calls += 1
+
+    def _start_profiler(self):
+        if self._profiler is None:
+            if self.profiler == 'pyinstrument':
+                from pyinstrument import Profiler
+
+                self._profiler = Profiler()
+            else:
+                import cProfile
+
+                self._profiler = cProfile.Profile()
+        # a restarted pyinstrument profiler appends to its session, as a re-enabled cProfile one to its stats
+        if self.profiler == 'pyinstrument':
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+        return self._profiler
+
+    def _stop_profiler(self, profiler):
+        if self.profiler == 'pyinstrument':
+            profiler.stop()
+        else:
+            profiler.disable()
+
+    def _dump_profile(self):
+        """ Write the profile of all the calls of the profiled stage, if it ran. """
+        if self._profiler is None:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        outname = os.path.join(self.profile_dir, f'{self.job}-{self.profile_stage}')
+        if self.profiler == 'pyinstrument':
+            outname += '.html'
+            with open(outname, 'w') as f:
+                f.write(self._profiler.output_html())
+        else:
+            outname += '.prof'
+            self._profiler.dump_stats(outname)
+        logger.info(f'[METRICS] >>>> Wrote profile of stage {self.profile_stage} to {outname}.')
+
+    def to_dicts(self):
+        """ Metrics of every stage, labelled with the job. """
+        return [dict(stage.to_dict(), job=self.job) for stage in self.stages.values()]
+
+    def export(self, path=None):
+        """ Export the metrics of every stage to a file, see self.path, and the profile of the profiled stage.
+
+        Args:
+            path (str or None): file to export to. Default: self.path, no metrics are exported if neither is set.
+        """
+        self._dump_profile()
+        path = path or self.path
+        if not path:
+            return
+        if path.endswith('.prom'):
+            self._export_prometheus(path)
+        else:
+            timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+            with open(path, 'a') as f:
+                f.write(''.join(json.dumps(dict(record, timestamp=timestamp)) + '\n' for record in self.to_dicts()))
+        logger.info(f'[METRICS] >>>> Exported metrics of job {self.job} to {path}.')
+
+    def _export_prometheus(self, path):
+        """ Write the metrics in the Prometheus text format. The file is replaced atomically, so a collector never
+        reads a partial file. """
+        lines = []
+        for metric, help_text, field in PROMETHEUS_METRICS:
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} gauge']
+            for record in self.to_dicts():
+                job, stage = _label_value(record['job']), _label_value(record['stage'])
+                lines.append(f'{metric}{{job="{job}",stage="{stage}"}} {record[field]}')
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+
+def _label_value(value):
+    """ Escape a Prometheus label value: backslashes, double quotes and line feeds. """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
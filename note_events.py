@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import struct
+import sys
+
+import numpy as np
+
+# logger with special stream handling to output to stdout in Node.js
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+stdout_handler.setLevel(logging.INFO)
+# logger.addHandler(stdout_handler)
+
+# fields of a note event, in order
+NOTE_FIELDS = ('key', 'onset', 'offset', 'velocity')
+# MIDI note number of piano key 1 (A0) is 21
+MIDI_KEY_OFFSET = 20
+# file extension of every note writer, see write_notes
+NOTE_FORMATS = {'json': '.json', 'midi': '.mid'}
+
+
+def extract_notes(chromagram, times, on_thresh, off_thresh, min_frames=2, delay_frames=4, amplitudes=None):
+    """ Merge the consecutive active frames of every key of a normalized chromagram into note events, with
+    hysteresis: a note starts once its key exceeds on_thresh, and lasts as long as it stays above off_thresh. A key
+    hovering around a single threshold would flicker into many short notes instead.
+
+    Args:
+        chromagram (np.ndarray): normalized chromagram (key x time), row i is key number i. Row 0 is not a key,
+            it is ignored.
+        times (np.ndarray): time (s) of every column
+        on_thresh (float): [0, 1] normalized amplitude a key must exceed to start a note
+        off_thresh (float): [0, on_thresh] normalized amplitude a key must stay above to go on
+        min_frames (int): notes shorter than this many frames are dropped
+        delay_frames (int): frames the chromagram lags the audio by (see KeyBoardVisualizer.filter_delay), taken
+            off the note times. Notes which end within the first delay_frames frames are dropped.
+        amplitudes (np.ndarray or None): amplitudes (key x time) the velocities are scaled from, e.g. the raw
+            chromagram. Default: chromagram.
+    Returns:
+        list: (key, onset, offset, velocity) notes sorted by onset then key. key is the piano key number (1 to
+            88), onset and offset are in seconds, velocity (1 to 127) is the note's peak amplitude relative to the
+            loudest of amplitudes.
+    """
+    chromagram = chromagram[1:89]
+    n_frames = chromagram.shape[1]
+    if not n_frames:
+        return []
+
+    # runs of frames above off_thresh, as [start, end) per key
+    above = np.zeros((chromagram.shape[0], n_frames + 2), dtype=np.int8)
+    above[:, 1:-1] = chromagram > off_thresh
+    edges = np.diff(above, axis=1)
+    keys, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)  # same row-major order, so ends pair up with starts
+
+    # a run is a note if it is long enough and exceeds on_thresh somewhere
+    on_counts = np.zeros((chromagram.shape[0], n_frames + 1), dtype=np.int64)
+    np.cumsum(chromagram > on_thresh, axis=1, out=on_counts[:, 1:])
+    is_note = (ends - starts >= min_frames) & (on_counts[keys, ends] > on_counts[keys, starts])
+    keys, starts, ends = keys[is_note], starts[is_note], ends[is_note]
+
+    # peak of every note: max over [start, end) of the flattened chromagram (padded, as the last end may be its
+    # length), the even intervals of reduceat
+    amplitudes = chromagram if amplitudes is None else amplitudes[1:89]
+    flat = np.append(amplitudes.ravel(), 0)
+    bounds = np.stack((keys * n_frames + starts, keys * n_frames + ends), axis=1).ravel()
+    peaks = np.maximum.reduceat(flat, bounds)[::2] if keys.size else np.zeros(0)
+    loudest = amplitudes.max() or 1
+    velocities = np.clip(np.rint(peaks / loudest * 127), 1, 127).astype(int)
+    onsets = times[np.maximum(starts - delay_frames, 0)]
+    offsets = times[np.clip(ends - delay_frames, 0, len(times) - 1)]
+    # notes ending within the delay are empty once shifted: their note off would precede their note on in MIDI
+    audible = offsets > onsets
+    keys, velocities, onsets, offsets = keys[audible], velocities[audible], onsets[audible], offsets[audible]
+
+    order = np.lexsort((keys, onsets))
+    return [
+        (int(keys[i]) + 1, round(float(onsets[i]), 3), round(float(offsets[i]), 3), int(velocities[i]))
+        for i in order
+    ]
+
+
+def write_json(notes, path, **info):
+    """ Write note events as compact JSON: the field names once, then one [key, onset, offset, velocity] list per
+    note.
+
+    Args:
+        notes (list): (key, onset, offset, velocity) notes, see extract_notes
+        path (str): output file
+        **info: extra top level fields (e.g. song, duration)
+    """
+    with open(path, 'w') as f:
+        json.dump(dict(info, fields=NOTE_FIELDS, notes=notes), f, separators=(',', ':'))
+
+
+def _var_len(value):
+    """ MIDI variable length quantity: 7 bits per byte, most significant first, the high bit set on all but the
+    last byte. """
+    data = [value & 0x7f]
+    value >>= 7
+    while value:
+        data.append(0x80 | value & 0x7f)
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def write_midi(notes, path, ticks_per_beat=480, tempo=500000):
+    """ Write note events as a Standard MIDI File (format 0, one track, channel 1).
+
+    Args:
+        notes (list): (key, onset, offset, velocity) notes, see extract_notes
+        path (str): output file
+        ticks_per_beat (int): time resolution
+        tempo (int): microseconds per beat. The default (120 bpm) makes 960 ticks a second.
+    """
+    ticks_per_second = ticks_per_beat * 1e6 / tempo
+    # (tick, note off before note on at the same tick, status, key, velocity)
+    events = []
+    for key, onset, offset, velocity in notes:
+        key += MIDI_KEY_OFFSET
+        events.append((round(onset * ticks_per_second), 1, 0x90, key, velocity))
+        events.append((round(offset * ticks_per_second), 0, 0x80, key, 0))
+    events.sort()
+
+    track = bytearray(b'\x00\xff\x51\x03' + tempo.to_bytes(3, 'big'))
+    last_tick = 0
+    for tick, _, status, key, velocity in events:
+        track += _var_len(tick - last_tick) + bytes((status, key, velocity))
+        last_tick = tick
+    track += b'\x00\xff\x2f\x00'  # end of track
+
+    with open(path, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, ticks_per_beat))
+        f.write(b'MTrk' + struct.pack('>I', len(track)) + track)
+
+
+def write_notes(notes, outname, formats, **info):
+    """ Write note events in several formats, next to each other.
+
+    Args:
+        notes (list): (key, onset, offset, velocity) notes, see extract_notes
+        outname (str): output path, without extension
+        formats (list): {json or midi} formats to write, see NOTE_FORMATS
+        **info: extra top level fields of the JSON file
+    Returns:
+        list: paths of the written files
+    """
+    paths = []
+    for note_format in formats:
+        path = outname + NOTE_FORMATS[note_format]
+        if note_format == 'json':
+            write_json(notes, path, **info)
+        else:
+            write_midi(notes, path)
+        logger.info(f'[NOTES] >>>> Wrote {len(notes)} notes to {path} ({os.path.getsize(path) / 1e3:.1f}KB).')
+        paths.append(path)
+    return paths
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from glob import escape as glob_escape
+from glob import glob
+
+# logger with special stream handling to output to stdout in Node.js
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+stdout_handler.setLevel(logging.INFO)
+# logger.addHandler(stdout_handler)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    song TEXT PRIMARY KEY,  -- YouTube id, or file name without extension
+    audio_path TEXT,        -- audio in the input dir
+    audio_size INTEGER,
+    audio_hash TEXT,        -- content hash of the audio, see ChromagramCache.hash_file
+    params TEXT,            -- JSON of the decomposition parameters the video was rendered with
+    video_path TEXT,        -- set once the video is complete
+    video_size INTEGER,
+    decompose_s REAL,
+    render_s REAL,
+    created REAL,
+    accessed REAL
+);
+CREATE INDEX IF NOT EXISTS songs_audio_hash ON songs (audio_hash);
+"""
+
+
+class OutputCatalog(object):
+    def __init__(self, path=os.path.join('output', 'catalog.sqlite'), input_dir='input', output_dir='output'):
+        """ Persistent catalog (SQLite) of the songs downloaded into the input dir and rendered into the output dir:
+        content hashes, decomposition parameters, artifact paths, sizes and timings. Lookups are by song name
+        (YouTube id) or audio hash, without scanning the dirs. A video is only cataloged once it is complete,
+        in a single transaction, so an interrupted render never counts as rendered.
+
+        A new catalog indexes the media files already in the dirs. Several processes may share a catalog.
+
+        Args:
+            path (str): SQLite database file
+            input_dir (str): dir of the downloaded audio, indexed on creation
+            output_dir (str): dir of the rendered videos, indexed on creation
+        """
+        self.path = path
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        if not os.path.exists(path):
+            self._create()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _create(self):
+        """ Create the database, and index the songs already in the input and output dirs. """
+        from media_ingest import MEDIA_EXTENSIONS
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+            connection.executescript(_SCHEMA)
+
+        inputs = [x for x in sorted(glob(os.path.join(self.input_dir, '*'))) if x.endswith(MEDIA_EXTENSIONS)]
+        for audio_path in inputs:
+            self.add_input(song_name(audio_path), audio_path)
+        outputs = [x for x in sorted(glob(os.path.join(self.output_dir, '*.mp4'))) if not x.endswith('.partial.mp4')]
+        for video_path in outputs:
+            self.add_output(song_name(video_path), video_path)
+        logger.info(f'[CATALOG] >>>> Created {self.path}: indexed {len(inputs)} inputs, {len(outputs)} outputs.')
+
+    def _upsert(self, song, **columns):
+        """ Insert or update the columns of a song, in a single transaction. """
+        now = time.time()
+        columns['accessed'] = now
+        names = ', '.join(columns)
+        updates = ', '.join(f'{name}=excluded.{name}' for name in columns)
+        self._execute(
+            f'INSERT INTO songs (song, created, {names}) VALUES (?, ?, {", ".join("?" * len(columns))}) '
+            f'ON CONFLICT(song) DO UPDATE SET {updates}',
+            (song, now, *columns.values())
+        )
+
+    def _execute(self, sql, params=()):
+        """ Run a statement in its own transaction. """
+        with closing(self._connect()) as connection, connection:
+            connection.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with closing(self._connect()) as connection:
+            return [dict(row) for row in connection.execute(sql, params)]
+
+    def add_input(self, song, audio_path):
+        """ Catalog the audio of a song, once it is in the input dir. """
+        self._upsert(song, audio_path=audio_path, audio_size=os.path.getsize(audio_path))
+
+    def add_output(self, song, video_path, audio_hash=None, params=None, decompose_s=None, render_s=None):
+        """ Catalog the video of a song, once it is complete.
+
+        Args:
+            song (str): name of the song
+            video_path (str): path of the complete video
+            audio_hash (str or None): content hash of the song's audio
+            params (dict or None): decomposition parameters the video was rendered with (JSON serializable)
+            decompose_s (float or None): wall time of the decomposition
+            render_s (float or None): wall time of the rendering
+        """
+        self._upsert(
+            song, video_path=video_path, video_size=os.path.getsize(video_path), audio_hash=audio_hash,
+            params=json.dumps(params, sort_keys=True) if params is not None else None,
+            decompose_s=decompose_s, render_s=render_s
+        )
+
+    def input(self, song):
+        """ Path of the audio of a song in the input dir, None if it was not downloaded (or was deleted). A song
+        copied into the input dir since the catalog was created is found there, and cataloged. """
+        from media_ingest import MEDIA_EXTENSIONS
+
+        rows = self._query('SELECT audio_path FROM songs WHERE song=?', (song,))
+        if rows and rows[0]['audio_path'] and os.path.exists(rows[0]['audio_path']):
+            return rows[0]['audio_path']
+        for audio_path in sorted(glob(os.path.join(glob_escape(self.input_dir), glob_escape(song) + '.*'))):
+            if audio_path.endswith(MEDIA_EXTENSIONS):
+                self.add_input(song, audio_path)
+                return audio_path
+        return None
+
+    def output(self, song=None, audio_hash=None, params=None):
+        """ Look up a rendered video by song name, or by the content hash of its audio and the parameters it was
+        rendered with (e.g. the same song downloaded under another name). Marks it as recently used.
+
+        Args:
+            song (str or None): name of the song
+            audio_hash (str or None): content hash of the audio, if song is None
+            params (dict or None): decomposition parameters, for lookups by audio_hash
+        Returns:
+            dict or None: catalog entry (see _SCHEMA), None if no complete video exists
+        """
+        if song is not None:
+            rows = self._query('SELECT * FROM songs WHERE song=? AND video_path IS NOT NULL', (song,))
+        else:
+            rows = self._query(
+                'SELECT * FROM songs WHERE audio_hash=? AND params=? AND video_path IS NOT NULL '
+                'ORDER BY accessed DESC',
+                (audio_hash, json.dumps(params, sort_keys=True))
+            )
+        for row in rows:
+            if os.path.exists(row['video_path']):
+                self._execute('UPDATE songs SET accessed=? WHERE song=?', (time.time(), row['song']))
+                return row
+        return None
+
+    def prune(self, max_age=None, max_size=None):
+        """ Evict songs (their audio, video, HLS segments and entry): those unused for more than max_age days, then
+        the least recently used ones until the artifacts of all songs fit in max_size.
+
+        Args:
+            max_age (float or None): max age in days since a song was last used
+            max_size (float or None): max total size of the audio and videos in MB
+        Returns:
+            list: names of the evicted songs
+        """
+        rows = self._query(
+            'SELECT song, audio_path, video_path, accessed, COALESCE(audio_size, 0) + COALESCE(video_size, 0) AS size '
+            'FROM songs ORDER BY accessed'
+        )
+        size = sum(row['size'] for row in rows)
+        evicted = []
+        for row in rows:
+            too_old = max_age is not None and row['accessed'] < time.time() - max_age * 86400
+            too_big = max_size is not None and size > max_size * 1e6
+            if not (too_old or too_big):
+                continue
+            for path in (row['video_path'], row['audio_path']):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            if row['video_path']:
+                # HLS segments the video was streamed as, see KeyBoardVisualizer.build_stream
+                shutil.rmtree(os.path.splitext(row['video_path'])[0], ignore_errors=True)
+            self._execute('DELETE FROM songs WHERE song=?', (row['song'],))
+            size -= row['size']
+            evicted.append(row['song'])
+            logger.info(f'[CATALOG] >>>> Evicted {row["song"]} ({row["size"] / 1e6:.2f}MB).')
+        return evicted
+
+
+def song_name(path):
+    """ Name of a song: its file name without extension. """
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['prune'])
+    parser.add_argument('--catalog', default=os.path.join('output', 'catalog.sqlite'), type=str)
+    parser.add_argument('--max_age', default=None, type=float)
+    parser.add_argument('--max_size', default=None, type=float)
+    args = parser.parse_args()
+
+    evicted = OutputCatalog(args.catalog).prune(max_age=args.max_age, max_size=args.max_size)
+    print(f'Evicted {len(evicted)} songs.')
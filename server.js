@@ -1,6 +1,7 @@
 const express = require("express");
 const app = express();
 const fs = require("fs");
+const http = require("http");
 const path = require("path");
 const spawn = require("await-spawn");
 const bodyParser = require("body-parser");
@@ -15,40 +16,118 @@ app.get("/",function(req,res) {
     res.sendFile(path.join(__dirname+"/templates/homepage.html"));
 });
 
-// temp endpoint to handle data for a post request for an input youtube link
-app.post("/handle_data", function(req, res){
-    console.log("Incoming request: YT UUID: "+req.body);
-    response = {yt_link : req.body.yt_link};
+// decomposition jobs run in the python worker service (worker_service.py), which keeps warm workers
+const WORKER_URL = process.env.WORKER_URL || "http://127.0.0.1:5000";
+const POLL_INTERVAL = 2000;
+// a job still running after this long (ms) is given up on, so a stuck worker does not hold the request forever
+const JOB_TIMEOUT = parseInt(process.env.JOB_TIMEOUT || 30 * 60 * 1000, 10);
 
-    // spawn the decomposition python pipeline
-    const { spawn } = require("child_process");
-    const pythonProcess = spawn("python3", ["audio_to_piano.py",  "--youtube", req.body.yt_link]);
+// send a JSON request to the worker service, callback(err, statusCode, body)
+function workerRequest(method, route, body, callback) {
+    const req = http.request(WORKER_URL + route, {method: method, headers: {"Content-Type": "application/json"}},
+        function(res) {
+            var raw = "";
+            res.on("data", (chunk) => raw += chunk);
+            res.on("end", function() {
+                var parsed;
+                try {
+                    parsed = JSON.parse(raw);
+                }
+                catch (err) {
+                    return callback(err);
+                }
+                callback(null, res.statusCode, parsed);
+            });
+        }
+    );
+    req.on("error", (err) => callback(err));
+    if (body) {
+        req.write(JSON.stringify(body));
+    }
+    req.end();
+}
 
-    // event callback to see python logs
-    pythonProcess.stdout.on("data", function(data) {
-        python_logs = data.toString();
-        console.log(python_logs);
-    });
+// endpoint to handle data for a post request for an input youtube link
+app.post("/handle_data", function(req, res){
+    console.log("Incoming request: YT UUID: "+req.body.yt_link);
+    const deadline = Date.now() + JOB_TIMEOUT;
 
-    // wait for python process to finish, redirect to streaming endpoint or error handling.
-    pythonProcess.on("close", (code) => {
-        console.log(`child process exited with code ${code}`);
-        if (code > 0) {
-            return res.status(500).send({message: python_logs});
+    // enqueue the decomposition job, then poll until it is done
+    workerRequest("POST", "/jobs", {yt_link: req.body.yt_link}, function(err, code, job) {
+        if (err) {
+            return res.status(500).send({message: "Worker service unavailable."});
         }
+        if (code >= 400) {
+            return res.status(code).send(job);
+        }
+        pollJob(job.job_id);
+    });
+
+    // wait for the job to finish, redirect to streaming endpoint or error handling.
+    function pollJob(job_id) {
+        workerRequest("GET", "/jobs/"+job_id, null, function(err, code, job) {
+            if (err || code >= 400) {
+                return res.status(500).send({message: err ? "Worker service unavailable." : job.message});
+            }
+            console.log(`job ${job_id}: ${job.status}`);
+            if (job.status === "failed") {
+                return res.status(500).send({message: job.error});
+            }
+            // a streaming job is still rendering, but its first segments can be played already
+            if (job.status !== "done" && job.status !== "streaming") {
+                if (Date.now() >= deadline) {
+                    return res.status(504).send({message: `Job ${job_id} timed out while ${job.status}.`});
+                }
+                return setTimeout(() => pollJob(job_id), POLL_INTERVAL);
+            }
+            console.log("Decomposing Sucessful! Redirecting to stream video.")
+            var fullUrl = req.protocol + "://" + req.get("host");
+            res.redirect(fullUrl+"/decomposed/?yt_id="+job_id);
+        });
+    }
+});
 
-        console.log("Decomposing Sucessful! Redirecting to stream video.")
-        var fullUrl = req.protocol + "://" + req.get("host");
-        var youtube_uuid = req.body.yt_link.split("=")[1];
-        res.redirect(fullUrl+"/decomposed/?yt_id="+youtube_uuid);
+// endpoint to check on a decomposition job
+app.get("/jobs/:job_id", function(req, res){
+    workerRequest("GET", "/jobs/"+req.params.job_id, null, function(err, code, job) {
+        if (err) {
+            return res.status(500).send({message: "Worker service unavailable."});
+        }
+        res.status(code).send(job);
     });
 });
 
 
-// endpoint to stream final video output
+// HLS playlist and segments of a video, served while it is being rendered (see KeyBoardVisualizer.build_stream).
+// The playlist grows until the render is done, and a re-render (e.g. with other parameters) rewrites the segments
+// under the same names, so none of them may be cached without revalidation (their ETag keeps it cheap).
+const HLS_FILE = /^(index\.m3u8|init\.mp4|segment_\d+\.m4s)$/;
+const HLS_TYPES = {".m3u8": "application/vnd.apple.mpegurl", ".mp4": "video/mp4", ".m4s": "video/iso.segment"};
+
+app.get("/hls/:yt_id/:file", function(req, res){
+    const yt_id = req.params.yt_id;
+    const file = req.params.file;
+    if (!/^[\w-]+$/.test(yt_id) || !HLS_FILE.test(file)) {
+        return res.status(404).send({message: "Not found."});
+    }
+    res.sendFile(path.join(__dirname, "output", yt_id, file), {headers: {
+        "Content-Type": HLS_TYPES[path.extname(file)],
+        "Cache-Control": "no-cache",
+    }}, function(err) {
+        if (err) {
+            res.status(404).end();
+        }
+    });
+});
+
+// endpoint to stream final video output. Videos rendered as HLS get the player page, which plays the playlist
+// as it grows.
 // credit where due: https://github.com/daspinola/video-stream-sample/blob/master/server.js
 app.get("/decomposed", (req, res) => {
     var yt_id = req.query.yt_id;
+    if (/^[\w-]+$/.test(yt_id) && fs.existsSync(path.join(__dirname, "output", yt_id, "index.m3u8"))) {
+        return res.sendFile(path.join(__dirname, "templates", "player.html"));
+    }
     var output_vid_path = "output/"+yt_id+".mp4";
     // extract video file metadata info for chunking
     const stat = fs.statSync(output_vid_path);
@@ -1,129 +1,83 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import csv
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 
-import pandas as pd
-import psutil
+import numpy as np
 
 
-def generate_frequency_table(scale=1):
-    """ Run some dataframe manipluation upon import to generate the note/frequency table mappings. """
-
-    # generate keypoints of octave 1 piano keys
-    top = 12 // scale
-    bottom_black = 168 // scale
-    bottom_white = 229 // scale
-    octave = 256 // scale
-
-    a = [
-        (22 // scale, top),
-        (22 // scale, bottom_black),
-        (7 // scale, bottom_black),
-        (7 // scale, bottom_white),
-        (43 // scale, bottom_white),
-        (43 // scale, bottom_black),
-        (30 // scale, bottom_black),
-        (30 // scale, top),
-    ]
-
-    bb = [(30 // scale, top), (30 // scale, bottom_black), (58 // scale, bottom_black), (58 // scale, top)]
-
-    b = [
-        (58 // scale, top),
-        (58 // scale, bottom_black),
-        (43 // scale, bottom_black),
-        (43 // scale, bottom_white),
-        (79 // scale, bottom_white),
-        (79 // scale, top),
-    ]
-
-    c = [
-        (79 // scale, top),
-        (79 // scale, bottom_white),
-        (116 // scale, bottom_white),
-        (116 // scale, bottom_black),
-        (102 // scale, bottom_black),
-        (102 // scale, top),
-    ]
-
-    db = [(102 // scale, top), (102 // scale, bottom_black), (131 // scale, bottom_black), (131 // scale, top)]
-
-    d = [
-        (131 // scale, top),
-        (131 // scale, bottom_black),
-        (116 // scale, bottom_black),
-        (116 // scale, bottom_white),
-        (153 // scale, bottom_white),
-        (153 // scale, bottom_black),
-        (138 // scale, bottom_black),
-        (138 // scale, top),
-    ]
-
-    eb = [(138 // scale, top), (138 // scale, bottom_black), (167 // scale, bottom_black), (167 // scale, top)]
-
-    e = [
-        (167 // scale, top),
-        (167 // scale, bottom_black),
-        (153 // scale, bottom_black),
-        (153 // scale, bottom_white),
-        (190 // scale, bottom_white),
-        (190 // scale, top),
-    ]
-
-    f = [
-        (190 // scale, top),
-        (190 // scale, bottom_white),
-        (224 // scale, bottom_white),
-        (224 // scale, bottom_black),
-        (212 // scale, bottom_black),
-        (212 // scale, top),
-    ]
-
-    gb = [(212 // scale, top), (212 // scale, bottom_black), (240 // scale, bottom_black), (240 // scale, top)]
-
-    g = [
-        (240 // scale, top),
-        (240 // scale, bottom_black),
-        (224 // scale, bottom_black),
-        (224 // scale, bottom_white),
-        (262 // scale, bottom_white),
-        (262 // scale, bottom_black),
-        (248 // scale, bottom_black),
-        (248 // scale, top),
-    ]
-
-    ab = [
-        (248 // scale, top),
-        (248 // scale, bottom_black),
-        (277 // scale, bottom_black),
-        (277 // scale, top)
-    ]
-
-    keys = {
-        'a': a,
-        'bb': bb,
-        'b': b,
-        'c': c,
-        'db': db,
-        'd': d,
-        'eb': eb,
-        'e': e,
-        'f': f,
-        'gb': gb,
-        'g': g,
-        'ab': ab,
+# outline of the 12 keys of an octave (starting from A) on the full resolution keyboard image (assets/piano.jpg),
+# as (x, y) vertices. y: 12 is the top of the keys, 168 the bottom of black keys, 229 the bottom of white keys.
+_OCTAVE_WIDTH = 256
+_OCTAVE_KEYS = (
+    ('a', [(22, 12), (22, 168), (7, 168), (7, 229), (43, 229), (43, 168), (30, 168), (30, 12)]),
+    ('bb', [(30, 12), (30, 168), (58, 168), (58, 12)]),
+    ('b', [(58, 12), (58, 168), (43, 168), (43, 229), (79, 229), (79, 12)]),
+    ('c', [(79, 12), (79, 229), (116, 229), (116, 168), (102, 168), (102, 12)]),
+    ('db', [(102, 12), (102, 168), (131, 168), (131, 12)]),
+    ('d', [(131, 12), (131, 168), (116, 168), (116, 229), (153, 229), (153, 168), (138, 168), (138, 12)]),
+    ('eb', [(138, 12), (138, 168), (167, 168), (167, 12)]),
+    ('e', [(167, 12), (167, 168), (153, 168), (153, 229), (190, 229), (190, 12)]),
+    ('f', [(190, 12), (190, 229), (224, 229), (224, 168), (212, 168), (212, 12)]),
+    ('gb', [(212, 12), (212, 168), (240, 168), (240, 12)]),
+    ('g', [(240, 12), (240, 168), (224, 168), (224, 229), (262, 229), (262, 168), (248, 168), (248, 12)]),
+    ('ab', [(248, 12), (248, 168), (277, 168), (277, 12)]),
+)
+
+
+@lru_cache(maxsize=None)
+def key_geometry(scale=1):
+    """ Table of the piano keys, in the row order of assets/freqs.csv (key 88 first), as plain numpy arrays.
+    Built once per scale. Row i is given the polygon generate_frequency_table joins onto it.
+
+    Args:
+        scale (int): factor the full resolution keyboard image is downsized by
+
+    Returns:
+        dict: read-only arrays of
+            key_numbers (int): key number of every row
+            frequencies (float): fundamental frequency (Hz) of every row
+            notes (str): note name of the polygon of every row
+            polygons (tuple): (n_vertices, 2) int array of (x, y) vertices of every row
+            x_extents (int): (first, last) x of the vertices of every row, the key's columns in the piano roll
+    """
+    with open(os.path.join('assets', 'freqs.csv'), encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+
+    notes, polygons = [], []
+    for octave in range(8):
+        for note, points in _OCTAVE_KEYS:
+            notes.append(f'{note}{octave}')
+            polygons.append(np.array(points) // scale + (octave * (_OCTAVE_WIDTH // scale), 0))
+    order = [88 - row for row in range(len(rows))]
+
+    geometry = {
+        'key_numbers': np.array([int(row['Keynumber']) for row in rows]),
+        'frequencies': np.array([float(row['Frequency (Hz)']) for row in rows]),
+        'notes': np.array([notes[i] for i in order]),
+        'polygons': tuple(polygons[i] for i in order),
+        'x_extents': np.array([(polygons[i][0, 0], polygons[i][-1, 0]) for i in order]),
     }
+    for array in (*geometry['polygons'], *(v for v in geometry.values() if isinstance(v, np.ndarray))):
+        array.flags.writeable = False
+    return geometry
+
+
+def generate_frequency_table(scale=1):
+    """ Run some dataframe manipluation upon import to generate the note/frequency table mappings.
+    See key_geometry for the same table as numpy arrays, without pandas. """
+    import pandas as pd
 
     # dataframe to map notes, frequencies, and keyboard keys
+    geometry = key_geometry(scale)
     freqs = pd.read_csv(os.path.join('assets', 'freqs.csv'))
-    df = pd.DataFrame(columns=['note', 'points'])
-
-    c = 0
-    for i in range(8):
-        for note, points in keys.items():
-            points = [(j + octave * i, k) for j, k in points]
-            df.loc[88 - c] = [note + str(i), points]
-            c += 1
+    df = pd.DataFrame({
+        'note': geometry['notes'],
+        'points': [[tuple(point) for point in polygon.tolist()] for polygon in geometry['polygons']],
+    })
     return freqs.join(df)
 
 
@@ -133,5 +87,203 @@ def get_memory_usage():
     Returns:
         float: Memory usage of current process in MB.
     """
+    import psutil
+
     pid = os.getpid()
     return round(psutil.Process(pid).memory_info().rss / 1e6, 2)
+
+
+def map_frequencies_to_keys(freqs, key_freqs):
+    """ Quantize frequencies to the nearest piano key frequency. Distance is measured on a log scale,
+    like the ear perceives pitch, so the boundary between two keys is their geometric mean.
+
+    Args:
+        freqs (np.ndarray): frequencies to quantize (e.g. STFT bin frequencies)
+        key_freqs (np.ndarray): fundamental frequencies of the piano keys, in any order
+
+    Returns:
+        np.ndarray: index into key_freqs of the nearest key, for every frequency
+    """
+    order = np.argsort(key_freqs)
+    log_keys = np.log(key_freqs[order])
+    boundaries = (log_keys[1:] + log_keys[:-1]) / 2
+    with np.errstate(divide='ignore'):
+        nearest = np.searchsorted(boundaries, np.log(freqs))
+    return order[nearest]
+
+
+def key_filterbank(freqs, key_freqs):
+    """ Sparse filterbank matrix summing spectrogram bins (e.g. STFT bins) into piano keys. Each key's filter is a
+    triangle on a log frequency scale, peaking at the key's frequency and reaching zero at its neighbours' (one
+    semitone away). Below ~100Hz keys are closer together than the bins: a key's filter then (also) linearly
+    interpolates the two bins around its frequency, so that no key falls between bins.
+
+    Args:
+        freqs (np.ndarray): ascending frequencies of the bins
+        key_freqs (np.ndarray): fundamental frequencies of the piano keys, in any order
+
+    Returns:
+        scipy.sparse.csr_matrix: weights (key x bin), rows in the order of key_freqs
+    """
+    from scipy.sparse import csr_matrix
+
+    with np.errstate(divide='ignore'):
+        semitones = 12 * np.log2(freqs[np.newaxis] / key_freqs[:, np.newaxis])
+    weights = np.maximum(1 - np.abs(semitones), 0)
+
+    above = np.clip(np.searchsorted(freqs, key_freqs), 1, freqs.size - 1)
+    below = above - 1
+    fraction = np.clip((key_freqs - freqs[below]) / (freqs[above] - freqs[below]), 0, 1)
+    rows = np.arange(key_freqs.size)
+    weights[rows, below] = np.maximum(weights[rows, below], 1 - fraction)
+    weights[rows, above] = np.maximum(weights[rows, above], fraction)
+    return csr_matrix(weights)
+
+
+def _median_inplace(x):
+    """ np.median(x, axis=1), partitioning x in place. Several times faster than np.median, which partitions
+    around both middle values of an even axis at once. """
+    mid = x.shape[1] // 2
+    x.partition(mid, axis=1)
+    if x.shape[1] % 2:
+        return x[:, mid]
+    return (x[:, :mid].max(axis=1) + x[:, mid]) / 2
+
+
+def windowed_nn_filter(S, width, window, k=None, block_frames=64):
+    """ Nearest-neighbour filter of a spectrogram: every frame is replaced by the median of its neighbours, like
+    librosa.decompose.nn_filter(S, aggregate=np.median, metric='cosine', width=width), but neighbours are only
+    searched within window frames of each frame. Time and memory grow linearly with the number of frames instead of
+    quadratically. Songs of less than window frames get librosa's result (up to ties).
+
+    Neighbours are picked as librosa.segment.recurrence_matrix does: out of the k + 2 * width most similar frames
+    (cosine similarity), the ones closer than width frames are dropped, and the first k remaining are kept.
+
+    Args:
+        S (np.ndarray): spectrogram (frequency x time)
+        width (int): frames closer than width frames to a frame are not its neighbours
+        window (int): max distance (frames) between a frame and its neighbours
+        k (int or None): number of neighbours. Default: librosa's, 2 * ceil(sqrt(n - 2 * width + 1)) where n is
+            the number of frames of a window
+        block_frames (int): number of frames filtered at once, bounds the size of the temporary arrays
+    Returns:
+        np.ndarray: filtered spectrogram, same shape, dtype and memory layout as S
+    """
+    n_frames = S.shape[1]
+    if k is None:
+        k = int(2 * np.ceil(np.sqrt(min(n_frames, 2 * window + 1) - 2 * width + 1)))
+    norms = np.linalg.norm(S, axis=0)
+    features = S / np.where(norms > 0, norms, 1)
+    # frames as rows: contiguous for the Fortran ordered spectrograms out of the STFT
+    frames, out = S.T, np.empty_like(S)
+    for start in range(0, n_frames, block_frames):
+        stop = min(start + block_frames, n_frames)
+        first, last = max(start - window, 0), min(stop + window, n_frames)
+        similarity = features[:, start:stop].T @ features[:, first:last]
+        distance = np.abs(np.arange(start, stop)[:, np.newaxis] - np.arange(first, last))
+        similarity[(distance == 0) | (distance > window)] = -np.inf
+
+        n_nearest = min(k + 2 * width, last - first - 1)
+        nearest = np.argpartition(-similarity, n_nearest - 1, axis=1)[:, :n_nearest]
+        dropped = ~np.isfinite(np.take_along_axis(similarity, nearest, axis=1))
+        nearest += first
+        dropped |= np.abs(nearest - np.arange(start, stop)[:, np.newaxis]) < width
+        nearest[dropped] = n_frames  # sorts last
+        neighbours = np.sort(nearest, axis=1)[:, :k]
+
+        full = neighbours[:, -1] < n_frames
+        out.T[start:stop][full] = _median_inplace(frames[neighbours[full]])
+        # frames with less than k neighbours (short songs): median of the ones they have, if any, as librosa
+        for i in np.nonzero(~full)[0]:
+            targets = neighbours[i][neighbours[i] < n_frames]
+            out.T[start + i] = np.median(frames[targets], axis=0) if targets.size else frames[start + i]
+    return out
+
+
+def tiled_apply(func, matrix, halo, tile_frames=1024, workers=1, executor='thread'):
+    """ Apply a function to a matrix (e.g. spectrogram, frequency x time) tile by tile along the time axis (axis 1),
+    on a pool of workers, and stitch its outputs back together. Every tile is given halo frames of context on each
+    side (fewer at the edges of the matrix), which are cropped off its outputs.
+
+    The result matches func(matrix) as long as every output frame only depends on the input frames within halo of
+    it, and func treats the edges of a tile like the edges of the matrix: e.g. median filters along time with
+    halo >= kernel_size // 2 (their boundary mode only applies to the tiles at the edges of the matrix), and any
+    function of single frames (median filters along frequency, masks) with halo = 0.
+
+    Args:
+        func (callable): tile (frequency x time) -> tuple of arrays of the tile's shape. Must be picklable for
+            processes, e.g. a module level function or a functools.partial of one.
+        matrix (np.ndarray): 2D matrix to tile
+        halo (int): frames of context on each side of a tile
+        tile_frames (int): number of frames of a tile (without its halo)
+        workers (int): number of workers. 1 runs the tiles one after the other in this thread.
+        executor (str): {thread or process}. Threads share the matrix and need func to release the GIL (numpy,
+            scipy.ndimage), forked processes get a copy of every tile but are not available in daemonic
+            processes (batch jobs, worker service).
+    Returns:
+        tuple: outputs of func, stitched (same shape and memory layout as matrix)
+    """
+    n_frames = matrix.shape[1]
+    starts = range(0, n_frames, tile_frames)
+    if len(starts) == 1:
+        return tuple(func(matrix))
+    # column slices of a Fortran ordered matrix (out of the STFT) are contiguous
+    tiles = (matrix[:, max(start - halo, 0): start + tile_frames + halo] for start in starts)
+
+    if workers <= 1:
+        results = map(func, tiles)
+    elif executor == 'thread':
+        pool = ThreadPoolExecutor(workers)
+        results = pool.map(func, tiles)
+    elif executor == 'process':
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        results = pool.map(func, tiles)
+    else:
+        raise ValueError(f'Given executor argument is not valid: {executor}')
+
+    outputs = None
+    try:
+        for start, tile_outputs in zip(starts, results):
+            if outputs is None:
+                outputs = tuple(np.empty_like(matrix, dtype=output.dtype) for output in tile_outputs)
+            offset = start - max(start - halo, 0)
+            for output, tile_output in zip(outputs, tile_outputs):
+                output[:, start: start + tile_frames] = tile_output[:, offset: offset + tile_frames]
+    finally:
+        if workers > 1:
+            pool.shutdown()
+    return outputs
+
+
+def find_peaks_2d(x, prominence):
+    """ Peak detection along axis 0 of a 2D matrix, equivalent to calling
+    scipy.signal.find_peaks(x[:, t], prominence=prominence) for every column t.
+
+    All columns are laid out end to end in a single vector, separated by +inf sentinels, so that local
+    maxima and prominences are computed in one pass over the whole matrix. A sentinel is never a
+    smaller neighbour, and it stops the prominence search exactly like the border of a column does.
+
+    Args:
+        x (np.ndarray): 2D matrix (e.g. log-amplitude spectrogram, frequency x time)
+        prominence (float): minimum prominence a peak must have
+
+    Returns:
+        np.ndarray: boolean mask of x.shape, True at detected peaks
+    """
+    from scipy.signal import find_peaks, peak_prominences
+
+    n_rows, n_cols = x.shape
+    padded = np.empty((n_cols, n_rows + 1), dtype=np.float64)
+    padded[:, 0] = np.inf
+    padded[:, 1:] = x.T
+    flat = padded.ravel()
+
+    # local maxima, minus the sentinels themselves, then threshold by prominence
+    peaks = find_peaks(flat)[0]
+    peaks = peaks[peaks % (n_rows + 1) != 0]
+    peaks = peaks[peak_prominences(flat, peaks)[0] >= prominence]
+
+    cols, rows = np.divmod(peaks, n_rows + 1)
+    mask = np.zeros(x.shape, dtype=bool)
+    mask[rows - 1, cols] = True
+    return mask
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests of the note event extraction and export (note_events.py).
+
+Run from the repo root: `python -m pytest tests`
+"""
+import struct
+
+import numpy as np
+
+from note_events import MIDI_KEY_OFFSET, extract_notes, write_midi
+
+
+def _chromagram(runs, n_frames=20):
+    """ Normalized chromagram (89 rows, row i is key i) active at 1 over [start, end) frames of some keys. """
+    chromagram = np.zeros((89, n_frames), dtype=np.float32)
+    for key, start, end in runs:
+        chromagram[key, start:end] = 1
+    return chromagram
+
+
+def _midi_notes(path):
+    """ (status, key) of every note event of a format 0 MIDI file written by write_midi, in order. """
+    with open(path, 'rb') as f:
+        data = f.read()
+    track_start = 14 + 8  # header chunk, then the track chunk header
+    track_len = struct.unpack('>I', data[track_start - 4:track_start])[0]
+    track, i, events = data[track_start:track_start + track_len], 0, []
+    while i < len(track):
+        while track[i] & 0x80:  # variable length delta time
+            i += 1
+        i += 1
+        if track[i] == 0xff:  # meta event: type, length, data
+            i += 3 + track[i + 2]
+        else:
+            events.append((track[i], track[i + 1]))
+            i += 3
+    return events
+
+
+def test_notes_ending_within_the_delay_are_dropped():
+    times = np.arange(20) * 0.1
+    chromagram = _chromagram([(40, 0, 3), (41, 0, 10)])
+
+    notes = extract_notes(chromagram, times, on_thresh=0.5, off_thresh=0.25, delay_frames=4)
+
+    assert [note[0] for note in notes] == [41]
+    assert all(offset > onset for _, onset, offset, _ in notes)
+
+
+def test_midi_turns_every_note_off(tmp_path):
+    times = np.arange(20) * 0.1
+    chromagram = _chromagram([(40, 0, 3), (41, 0, 10), (42, 12, 18)])
+    path = str(tmp_path / 'notes.mid')
+
+    write_midi(extract_notes(chromagram, times, on_thresh=0.5, off_thresh=0.25, delay_frames=4), path)
+
+    active = set()
+    for status, key in _midi_notes(path):
+        if status == 0x90:
+            assert key not in active
+            active.add(key)
+        else:
+            active.remove(key)
+    assert not active
+    assert MIDI_KEY_OFFSET + 40 not in {key for _, key in _midi_notes(path)}
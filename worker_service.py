@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from multiprocessing import Pipe, Process, Queue
+from multiprocessing.connection import wait
+
+from flask import Flask, jsonify, request
+
+import audio_to_piano
+from audio_to_piano import DecomposerError, decompose_song, get_metrics, setup_dirs
+from chromagram_cache import ChromagramCache, pin_numba_cache
+from note_events import NOTE_FORMATS
+from output_catalog import OutputCatalog
+
+# audio_to_piano imports the DSP stack on demand: import it once here, for the warm workers to inherit, once the
+# numba cache is pinned
+pin_numba_cache()
+import decomposer  # noqa: E402,F401
+import key_board_visualizer  # noqa: E402,F401
+
+# logger with special stream handling to output to stdout in Node.js
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+stdout_handler.setLevel(logging.INFO)
+logger.addHandler(stdout_handler)
+
+# job states. A job is in flight until it is done or failed. A streaming job is still rendering, but the segments
+# rendered so far can be played (see audio_to_piano.decompose_song).
+QUEUED, DOWNLOADING, DECOMPOSING, RENDERING, STREAMING, DONE, FAILED = (
+    'queued', 'downloading', 'decomposing', 'rendering', 'streaming', 'done', 'failed'
+)
+
+
+def _worker_loop(job_queue, status_conn, cache, catalog, metrics_args, job_args):
+    """ Entry point of a warm worker process. Librosa & co. are already imported (inherited from the parent
+    process), so every job skips the interpreter and import cost. Runs jobs until it gets a None job.
+
+    Args:
+        job_queue (multiprocessing.Queue): (job_id, youtube_url) jobs to run
+        status_conn (multiprocessing.Connection): to report (job_id, status, error) updates back. Sends are
+            synchronous, so no update is lost if the worker dies right after.
+        cache (ChromagramCache or None): on-disk cache of intermediate artifacts, shared by all workers
+        catalog (OutputCatalog): catalog of the downloaded and rendered songs, shared by all workers
+        metrics_args (dict): metrics export & profiling arguments of every job, see audio_to_piano.get_metrics
+        job_args (dict): options of every job (notes, dsp_workers), see audio_to_piano.decompose_song
+    """
+    notes = job_args.get('notes', None)
+    dsp_workers = job_args.get('dsp_workers', None)
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        job_id, youtube_url = job
+
+        def progress(stage):
+            status_conn.send((job_id, stage, None))
+
+        try:
+            progress(DOWNLOADING)
+            input_song = audio_to_piano._handle_youtube_option(youtube_url, catalog, notes)
+            if input_song:
+                decompose_song(
+                    input_song, progress=progress, cache=cache,
+                    metrics=get_metrics(metrics_args, job_id, per_job=True), catalog=catalog, stream=True,
+                    notes=notes, video=not audio_to_piano.is_rendered(input_song, catalog), dsp_workers=dsp_workers
+                )
+            status_conn.send((job_id, DONE, None))
+        except DecomposerError as e:
+            status_conn.send((job_id, FAILED, e.message))
+        except Exception:
+            status_conn.send((job_id, FAILED, traceback.format_exc()))
+
+
+class JobQueue(object):
+    def __init__(self, workers=2, max_queue=16, cache=None, catalog=None, metrics_args=None, job_args=None):
+        """ Bounded queue of decomposition jobs, run by a pool of long-lived worker processes.
+        Jobs are keyed by YouTube id: submitting a song that is already in flight (or done) returns that job.
+
+        Args:
+            workers (int): number of warm worker processes
+            max_queue (int): max number of queued (not yet running) jobs, further submissions are rejected
+            cache (ChromagramCache or None): on-disk cache of intermediate artifacts
+            catalog (OutputCatalog or None): catalog of the downloaded and rendered songs.
+                Default: output/catalog.sqlite
+            metrics_args (dict or None): metrics export & profiling arguments (metrics, profile, profiler),
+                see audio_to_piano.get_metrics. Default: metrics are not exported.
+            job_args (dict or None): options of every job: notes (formats to export the note events to) and
+                dsp_workers (threads HPSS tiles are spread over), see audio_to_piano.decompose_song. Default: videos
+                only, HPSS on 1 thread.
+        """
+        self.n_workers = workers
+        self.max_queue = max_queue
+        self.cache = cache
+        self.catalog = catalog
+        self.metrics_args = metrics_args or {}
+        self.job_args = job_args or {}
+
+        self.jobs = {}  # job_id -> job state dict
+        self._lock = threading.Lock()
+        self._job_queue = Queue()
+        self._workers = [None] * workers
+        self._status_conns = [None] * workers
+        self._running = [None] * workers  # job_id each worker is running
+        self._stopping = threading.Event()
+
+    def start(self):
+        """ Start the worker processes and the thread collecting their status updates. """
+        setup_dirs()
+        self.catalog = self.catalog or OutputCatalog()
+        for worker_id in range(self.n_workers):
+            self._start_worker(worker_id)
+        threading.Thread(target=self._collect_status, daemon=True).start()
+        logger.info(f'[WORKER] >>>> Started {self.n_workers} workers.')
+
+    def stop(self):
+        """ Let the workers finish their current job and exit. Queued jobs are dropped. """
+        self._stopping.set()
+        for _ in self._workers:
+            self._job_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        logger.info(f'[WORKER] >>>> Stopped {self.n_workers} workers.')
+
+    def _start_worker(self, worker_id):
+        status_conn, child_conn = Pipe(duplex=False)
+        worker = Process(
+            target=_worker_loop,
+            args=(self._job_queue, child_conn, self.cache, self.catalog, self.metrics_args, self.job_args),
+            daemon=True
+        )
+        worker.start()
+        child_conn.close()
+        self._workers[worker_id] = worker
+        self._status_conns[worker_id] = status_conn
+        self._running[worker_id] = None
+
+    def submit(self, youtube_url):
+        """ Enqueue a YouTube video for decomposition, deduplicated by YouTube id: jobs in flight, and done jobs
+        whose video is still cataloged, are returned as they are.
+
+        Args:
+            youtube_url (str): youtube video url
+        Returns:
+            dict or None: state of the job, None if the queue is full
+        """
+        if 'https://www.youtube.com/watch?v=' not in youtube_url:
+            raise DecomposerError(f'{youtube_url} is not a valid YouTube URL')
+        job_id = youtube_url.split('=')[-1]
+
+        with self._lock:
+            job = self.jobs.get(job_id)
+            # a done job whose video was since removed (e.g. pruned from the catalog) is run again
+            if job and job['status'] != FAILED and (
+                job['status'] != DONE or audio_to_piano.is_rendered(job_id, self.catalog)
+            ):
+                return dict(job)
+            if sum(job['status'] == QUEUED for job in self.jobs.values()) >= self.max_queue:
+                return None
+
+            now = time.time()
+            self.jobs[job_id] = {
+                'job_id': job_id, 'status': QUEUED, 'error': None, 'submitted': now, 'updated': now
+            }
+            self._job_queue.put((job_id, youtube_url))
+            logger.info(f'[WORKER] >>>> Queued job {job_id}.')
+            return dict(self.jobs[job_id])
+
+    def status(self, job_id):
+        """ Current state of a job, None if unknown. """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id, status, error=None):
+        with self._lock:
+            job = self.jobs[job_id]
+            job.update(status=status, error=error, updated=time.time())
+            if status == DOWNLOADING:
+                job['started'] = job['updated']
+            if status == STREAMING:
+                job['first_segment_s'] = round(job['updated'] - job['started'], 2)
+            if status in (DONE, FAILED):
+                job['wall_time'] = round(job['updated'] - job['started'], 2)
+        logger.info(f'[WORKER] >>>> Job {job_id}: {status}.')
+
+    def _collect_status(self):
+        """ Apply status updates from the workers to the jobs. Restarts workers that died, failing their job. """
+        while not self._stopping.is_set():
+            wait(self._status_conns, timeout=1)
+            for worker_id, status_conn in enumerate(self._status_conns):
+                try:
+                    while status_conn.poll():
+                        job_id, status, error = status_conn.recv()
+                        self._running[worker_id] = None if status in (DONE, FAILED) else job_id
+                        self._update(job_id, status, error)
+                except EOFError:  # worker exited, handled below
+                    pass
+
+            for worker_id, worker in enumerate(self._workers):
+                if not worker.is_alive() and not self._stopping.is_set():
+                    job_id = self._running[worker_id]
+                    if job_id:
+                        self._update(job_id, FAILED, f'worker exited with code {worker.exitcode}')
+                    logger.error(f'[WORKER] >>>> Worker {worker_id} died. Restarting.')
+                    self._status_conns[worker_id].close()
+                    self._start_worker(worker_id)
+
+
+def create_app(job_queue):
+    """ HTTP front of the job queue.
+
+    Args:
+        job_queue (JobQueue): started job queue
+    Returns:
+        flask.Flask: app
+    """
+    app = Flask(__name__)
+
+    @app.route('/jobs', methods=['POST'])
+    def submit_job():
+        youtube_url = (request.get_json(silent=True) or request.form).get('yt_link', '')
+        try:
+            job = job_queue.submit(youtube_url)
+        except DecomposerError as e:
+            return jsonify({'message': e.message}), 400
+        if job is None:
+            return jsonify({'message': 'Job queue is full, try again later.'}), 503
+        return jsonify(job), 202
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        job = job_queue.status(job_id)
+        if job is None:
+            return jsonify({'message': f'Unknown job {job_id}.'}), 404
+        return jsonify(job)
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('--port', default=5000, type=int)
+    parser.add_argument('-w', '--workers', default=2, type=int)
+    parser.add_argument('-q', '--max_queue', default=16, type=int)
+    parser.add_argument('-c', '--cache_dir', default='cache', type=str)
+    parser.add_argument('--cache_size', default=1024, type=float)
+    parser.add_argument('--catalog', default=os.path.join('output', 'catalog.sqlite'), type=str)
+    parser.add_argument('-n', '--notes', default=None, nargs='+', choices=sorted(NOTE_FORMATS))
+    parser.add_argument('--dsp_workers', default=None, type=int)
+    parser.add_argument('--metrics', default=None, type=str)
+    parser.add_argument('--profile', default=None, type=str)
+    parser.add_argument('--profiler', default='cprofile', choices=['cprofile', 'pyinstrument'])
+    args = parser.parse_args()
+
+    cache = ChromagramCache(args.cache_dir, max_size=args.cache_size) if args.cache_dir else None
+    metrics_args = {'metrics': args.metrics, 'profile': args.profile, 'profiler': args.profiler}
+    jobs = JobQueue(
+        workers=args.workers, max_queue=args.max_queue, cache=cache, catalog=OutputCatalog(args.catalog),
+        metrics_args=metrics_args, job_args={'notes': args.notes, 'dsp_workers': args.dsp_workers}
+    )
+    jobs.start()
+    try:
+        create_app(jobs).run(host=args.host, port=args.port, threaded=True)
+    finally:
+        jobs.stop()